@@ -0,0 +1,325 @@
+"""
+Benchmarks for the phases of a Pycco build.
+
+Every benchmark runs on a deterministic synthetic corpus, so results from
+different checkouts of the tree can be compared:
+
+    python benchmarks/bench.py run -o before.json
+    ... hack, hack ...
+    python benchmarks/bench.py run -o after.json
+    python benchmarks/bench.py compare before.json after.json
+
+Each language in `pycco.languages` gets small, medium and pathological
+sources, each both comment-heavy and code-heavy, and each of `parse`,
+`highlight`, `render_markdown`, `generate_html` is timed on them separately.
+`process` is timed on a tree with one source per language, and
+`generate_index` on a deep tree of documentation files.
+
+`compare` exits with status 1 when any benchmark is slower than the baseline
+by more than the threshold.
+"""
+from __future__ import absolute_import, print_function
+
+import argparse
+import fnmatch
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pycco.main as pycco  # noqa: E402
+from pycco import __version__  # noqa: E402
+from pycco.generate_index import generate_index  # noqa: E402
+from pycco.languages import supported_filenames, supported_languages  # noqa: E402
+
+RESULTS_FORMAT = 1
+
+# Number of comment/code sections in each size of source.
+sizes = {
+    "small": 20,
+    "medium": 200,
+    # Thousands of one-line sections, the worst case for parsing.
+    "pathological": 3000,
+}
+
+# Lines of comment and of code per section, for each mix.
+mixes = {
+    "comments": (6, 1),
+    "code": (1, 12),
+}
+
+# The shape of the tree of documentation files for `generate_index`.
+index_depth = 6
+index_fanout = 3
+
+
+# === Corpora ===
+
+def benchmark_languages():
+    """
+    One language definition for each language Pycco knows, in a stable order.
+    """
+    languages = {}
+    for language in list(supported_languages.values()) + list(supported_filenames.values()):
+        languages.setdefault(language["name"], language)
+    return [languages[name] for name in sorted(languages)]
+
+
+def make_source(language, sections, mix):
+    """
+    Build a source in `language` with `sections` sections of the given mix of
+    comment and code lines. The text is the same on every run.
+    """
+    comment_lines, code_lines = mixes[mix]
+    if sections == sizes["pathological"]:
+        comment_lines, code_lines = 1, 1
+    symbol = language["comment_symbol"]
+    lines = []
+    for i in range(sections):
+        for j in range(comment_lines):
+            lines.append(u"{} Section {} explains *step* {} with `value_{}`.".format(
+                symbol, i, j, i))
+        for j in range(code_lines):
+            lines.append(u"value_{} = compute({}, \"text {}\") + {}".format(
+                i, i * j, j, j))
+    return u"\n".join(lines) + u"\n"
+
+
+def make_index_files(outdir, depth=index_depth, fanout=index_fanout):
+    """
+    The paths of a complete tree of documentation files, `fanout` files and
+    directories wide and `depth` directories deep.
+    """
+    files = []
+    stack = [(outdir, 0)]
+    while stack:
+        directory, level = stack.pop()
+        for i in range(fanout):
+            files.append(os.path.join(directory, "page_{}.html".format(i)))
+            if level < depth:
+                stack.append((os.path.join(directory, "dir_{}".format(i)), level + 1))
+    return sorted(files)
+
+
+# === Benchmarks ===
+#
+# Each benchmark is a name and a pair of functions: `setup` builds fresh input
+# for each timed run, outside the timing, and `run` is what gets timed.
+
+def phase_benchmarks(outdir):
+    """
+    Benchmarks for the phases of documenting a single source.
+    """
+    for language in benchmark_languages():
+        pycco.compile_language(language)
+        pycco.get_lexer(language)
+        for size in sorted(sizes):
+            for mix in sorted(mixes):
+                if size == "pathological" and mix != "code":
+                    continue
+                code = make_source(language, sizes[size], mix)
+                name = "{}/{}/{}".format(language["name"], size, mix)
+                for benchmark in _phases(name, code, language, outdir):
+                    yield benchmark
+
+
+def _phases(name, code, language, outdir):
+    prepared = {}
+
+    def prepare(key):
+        # Build the input for a phase only once, and only if it gets run.
+        if not prepared:
+            prepared["sections"] = pycco.parse(code, language)
+            prepared["docs"] = u"\n\n".join(s["docs_text"] for s in prepared["sections"])
+            prepared["highlighted"] = pycco.highlight(
+                [dict(s) for s in prepared["sections"]], language,
+                preserve_paths=False, outdir=outdir)
+        return prepared[key]
+
+    source = os.path.join(outdir, "source")
+
+    yield ("parse/" + name,
+           lambda: None,
+           lambda _: pycco.parse(code, language))
+    yield ("highlight/" + name,
+           lambda: [dict(s) for s in prepare("sections")],
+           lambda fresh: pycco.highlight(fresh, language, preserve_paths=False,
+                                         outdir=outdir))
+    yield ("markdown/" + name,
+           lambda: prepare("docs"),
+           pycco.render_markdown)
+    yield ("generate_html/" + name,
+           lambda: prepare("highlighted"),
+           lambda sections: pycco.generate_html(source, sections,
+                                                preserve_paths=False, outdir=outdir))
+
+
+def build_benchmarks(workdir):
+    """
+    Benchmarks for `process` and `generate_index` on whole trees.
+    """
+    sources = os.path.join(workdir, "sources")
+    for i, language in enumerate(benchmark_languages()):
+        levels = ["level_{}".format(j) for j in range(i % 4)]
+        directory = os.path.join(sources, language["name"], *levels)
+        os.makedirs(directory)
+        extensions = sorted(e for e, l in supported_languages.items() if l is language)
+        if extensions:
+            filename = "source" + extensions[0]
+        else:
+            filename = sorted(n for n, l in supported_filenames.items() if l is language)[0]
+        with io.open(os.path.join(directory, filename), "w") as f:
+            f.write(make_source(language, sizes["medium"], "code"))
+
+    docs = os.path.join(workdir, "docs")
+
+    def quietly(function):
+        def run(_):
+            stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+            try:
+                function()
+            finally:
+                sys.stdout.close()
+                sys.stdout = stdout
+        return run
+
+    build = quietly(lambda: pycco.process([sources], outdir=docs,
+                                          preserve_paths=True, skip=True))
+    yield ("process/tree",
+           lambda: shutil.rmtree(docs, ignore_errors=True),
+           build)
+    # An untimed build first, so that only a build with nothing to do is
+    # timed, even when this benchmark is run on its own.
+    yield ("process/tree/unchanged",
+           lambda: build(None),
+           build)
+
+    files = make_index_files(docs)
+    yield ("generate_index/depth-{}-fanout-{}".format(index_depth, index_fanout),
+           lambda: None,
+           lambda _: generate_index(files, docs))
+
+
+def time_benchmark(setup, run, repeat):
+    """
+    Time `repeat` runs of a benchmark, returning the times in seconds.
+    """
+    timer = timeit.default_timer
+    times = []
+    for _ in range(repeat):
+        data = setup()
+        start = timer()
+        run(data)
+        times.append(timer() - start)
+    return times
+
+
+def run_benchmarks(patterns=None, repeat=3):
+    """
+    Run the benchmarks whose names match any of `patterns`, returning the
+    results ready to be saved as JSON.
+    """
+    workdir = tempfile.mkdtemp(prefix="pycco-bench-")
+    results = {}
+    try:
+        benchmarks = itertools.chain(phase_benchmarks(workdir),
+                                     build_benchmarks(workdir))
+        for name, setup, run in benchmarks:
+            if patterns and not any(fnmatch.fnmatch(name, p) for p in patterns):
+                continue
+            times = sorted(time_benchmark(setup, run, repeat))
+            results[name] = {
+                "min": times[0],
+                "median": times[len(times) // 2],
+                "repeat": repeat,
+            }
+            print("{:<60} {:>10.2f} ms".format(name, times[0] * 1000))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "format": RESULTS_FORMAT,
+        "pycco": __version__,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results,
+    }
+
+
+# === Comparing results ===
+
+def compare_results(baseline, current, threshold=0.1):
+    """
+    Compare two sets of results by the fastest time of each benchmark they
+    share, returning `(name, baseline, current, ratio)` rows and the names of
+    the benchmarks that are slower by more than `threshold`.
+    """
+    rows = []
+    regressions = []
+    for name in sorted(set(baseline["benchmarks"]) & set(current["benchmarks"])):
+        before = baseline["benchmarks"][name]["min"]
+        after = current["benchmarks"][name]["min"]
+        ratio = after / before if before else 1.0
+        rows.append((name, before, after, ratio))
+        if ratio > 1 + threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def load_results(filename):
+    with io.open(filename, encoding="utf-8") as f:
+        results = json.load(f)
+    if results.get("format") != RESULTS_FORMAT:
+        raise ValueError("{} is not a Pycco benchmark results file".format(filename))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="Run the benchmarks")
+    run.add_argument("-o", "--output", help="Save the results to this JSON file")
+    run.add_argument("-k", "--filter", action="append", metavar="PATTERN",
+                     help="Only run benchmarks whose names match this glob")
+    run.add_argument("-r", "--repeat", type=int, default=3,
+                     help="Number of timed runs of each benchmark")
+
+    compare = commands.add_parser("compare", help="Compare two results files")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("-t", "--threshold", type=float, default=0.1,
+                         help="Flag benchmarks slower by more than this fraction")
+
+    args = parser.parse_args()
+
+    if args.command == "run":
+        results = run_benchmarks(args.filter, args.repeat)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+        return 0
+
+    if args.command == "compare":
+        rows, regressions = compare_results(load_results(args.baseline),
+                                            load_results(args.current),
+                                            args.threshold)
+        for name, before, after, ratio in rows:
+            flag = "  REGRESSION" if name in regressions else ""
+            print("{:<60} {:>10.2f} {:>10.2f} ms {:>6.2f}x{}".format(
+                name, before * 1000, after * 1000, ratio, flag))
+        return 1 if regressions else 0
+
+    parser.print_help()
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
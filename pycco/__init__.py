@@ -1,3 +1,7 @@
+__version__ = "0.6.0"
+
 from .main import *  # noqa
+from .builder import Builder  # noqa
+from .output import FileSink, MemorySink, ZipSink  # noqa
 
-__all__ = ("process",)
+__all__ = ("process", "Builder", "FileSink", "MemorySink", "ZipSink")
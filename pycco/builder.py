@@ -0,0 +1,140 @@
+"""
+A `Builder` renders documentation in-process, from code that need not be on
+disk, for programs that embed Pycco.
+
+The builder holds on to everything that is costly to set up: Pygments lexers
+and formatters, the Markdown engine and the compiled template are made once
+and reused for every page, and the sections of every page are kept, so that a
+page rendered again only re-renders the sections that changed. Pages are
+rendered lazily, one for each `(path, code)` pair, and handed to an optional
+sink from `pycco.output`:
+
+    builder = Builder(sink=MemorySink())
+    for result in builder.build([("example.py", code)]):
+        print(result["name"], len(result["html"]))
+
+A builder keeps its state between calls, so it should be used by one thread
+at a time.
+"""
+from __future__ import absolute_import
+
+from os import path
+
+from pycco.cache import DEFAULT_MAX_SIZE, SectionCache
+from pycco.main import (_document_sections, _html_formatter, _page_context,
+                        destination, get_language, get_lexer, render_markdown)
+from pycco.output import minify_css, minify_html, sink_name
+from pycco_resources import css as pycco_css
+from pycco_resources import pycco_template
+
+__all__ = ('Builder',)
+
+# Pages are rendered relative to this virtual output directory, and named
+# relative to it.
+ROOT = '.'
+
+# A builder with a section cache prunes it after this many pages, and when
+# it is closed.
+PRUNE_INTERVAL = 1000
+
+
+class Builder(object):
+    """
+    Render pages from `(path, code)` pairs, writing them to `sink` if one is
+    given. `preserve_paths`, `language` and `encoding` are as for `process()`;
+    `encoding` is only used for code given as bytes. With `minify`, pages and
+    the stylesheet are compacted. Set `cache_dir` to share rendered sections
+    with other builds through a `SectionCache`, which is kept to `cache_size`
+    bytes, and `keep` to `False` not to keep the sections of every page in
+    memory.
+    """
+
+    def __init__(self, sink=None, preserve_paths=True, language=None,
+                 encoding='utf8', minify=False, cache_dir=None,
+                 cache_size=DEFAULT_MAX_SIZE, keep=True):
+        self.sink = sink
+        self.preserve_paths = preserve_paths
+        self.language = language
+        self.encoding = encoding
+        self.minify = minify
+        self.cache = SectionCache(cache_dir, cache_size) if cache_dir else None
+        self.kept = {} if keep else None
+        self.wrote_css = False
+        self.rendered = 0
+        if language is not None:
+            # An unknown language is an error now, rather than on every page.
+            get_language(None, None, language_name=language)
+
+    def warm(self, languages=()):
+        """
+        Set up Markdown, the Pygments formatter and the lexers of the named
+        `languages` ahead of the first page, which otherwise does it.
+        """
+        render_markdown(u'')
+        _html_formatter()
+        for name in languages:
+            get_lexer(get_language(None, None, language_name=name))
+        return self
+
+    def render(self, source, code):
+        """
+        Render the page for the file at `source`, whose contents are `code`,
+        returning a result dictionary: the `source`, the `name` of its page,
+        the `html` of the page as bytes, and the `error` if it could not be
+        rendered. The page is written to the sink, if any. A `source` whose
+        page would be outside the output, such as `../a.py`, is an error.
+        """
+        result = {'source': source, 'name': None, 'html': None, 'error': None}
+        self.rendered += 1
+        if self.cache is not None and not self.rendered % PRUNE_INTERVAL:
+            self.cache.prune()
+        try:
+            dest = destination(source, preserve_paths=self.preserve_paths,
+                               outdir=ROOT)
+            result['name'] = sink_name(path.relpath(dest, ROOT))
+            if isinstance(code, bytes):
+                code = code.decode(self.encoding)
+            sections = _document_sections(source, code, ROOT,
+                                          self.preserve_paths, self.language,
+                                          cache=self.cache, kept=self.kept)
+        except (ValueError, UnicodeDecodeError) as e:
+            result['error'] = e
+            return result
+
+        html = pycco_template(_page_context(source, sections,
+                                            self.preserve_paths, ROOT))
+        if self.minify:
+            html = minify_html(html)
+        result['html'] = html.encode('utf-8')
+
+        if self.sink is not None:
+            if not self.wrote_css:
+                css = minify_css(pycco_css) if self.minify else pycco_css
+                self.sink.write('pycco.css', css.encode('utf-8'))
+                self.wrote_css = True
+            self.sink.write(result['name'], result['html'])
+        return result
+
+    def build(self, sources):
+        """
+        Render the pages for an iterable of `(path, code)` pairs, yielding
+        the result of each as it is rendered.
+        """
+        for source, code in sources:
+            yield self.render(source, code)
+
+    def forget(self, source):
+        """
+        Drop the sections kept for `source`, once it is gone for good.
+        """
+        if self.kept is not None:
+            self.kept.pop(source, None)
+
+    def close(self):
+        """
+        Close the sink, and prune the section cache.
+        """
+        if self.cache is not None:
+            self.cache.prune()
+        if self.sink is not None:
+            self.sink.close()
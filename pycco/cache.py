@@ -0,0 +1,242 @@
+"""
+A persistent, content-addressed cache for rendered sections.
+
+Highlighted code and rendered docs are stored in a directory, one small file
+per entry, named after a hash of everything that went into rendering them.
+The same license header, vendored file or boilerplate docstring is then only
+run through Pygments or Markdown once, no matter how many files or builds it
+turns up in.
+
+Entries are written to a temporary file and renamed into place, so readers
+never see a partial entry, and writers racing to store the same entry store
+the same bytes. That makes the cache safe to share between worker processes,
+and between machines on a common filesystem. Every hit refreshes the entry's
+modification time, and `prune()` evicts the least recently used entries once
+the cache grows past its size limit. Since entries are only ever added by
+renaming them into their directory, `prune()` only looks at every entry when
+one of the directories has changed since it last did.
+"""
+from __future__ import absolute_import
+
+import errno
+import hashlib
+import os
+import time
+from os import path
+
+__all__ = ('SectionCache', 'docs_key', 'code_keys')
+
+# The default size limit of a cache, in bytes.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Pruning stops once the cache is back under this fraction of its limit, so
+# that a cache at its limit is not pruned again after every build.
+LOW_WATER_MARK = 0.9
+
+# Temporary files older than this many seconds were left behind by a writer
+# that died, and are removed by `prune()`.
+STALE_TEMP_AGE = 3600
+
+TEMP_PREFIX = '.tmp-'
+
+# Touched by every `prune()` that looks at the entries, to tell whether any
+# have been added since.
+PRUNE_STAMP = '.pruned'
+
+
+class SectionCache(object):
+    """
+    A cache of rendered `code_html` and `docs_html` in `directory`, holding at
+    most about `max_size` bytes.
+    """
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+
+    def _path(self, key):
+        return path.join(self.directory, key[:2], key[2:])
+
+    def get(self, key):
+        """
+        Return the text stored under `key`, or `None` if there is none.
+        """
+        filename = self._path(key)
+        try:
+            with open(filename, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+
+        # Mark the entry as recently used. Another process may have evicted
+        # it in the meantime, which is fine: we already have its contents.
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+        return data.decode('utf-8')
+
+    def put(self, key, text):
+        """
+        Store `text` under `key`.
+        """
+        import socket
+        import uuid
+
+        filename = self._path(key)
+        directory = path.dirname(filename)
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        temp = path.join(directory, '{}{}-{}-{}'.format(
+            TEMP_PREFIX, socket.gethostname(), os.getpid(), uuid.uuid4().hex))
+        with open(temp, 'wb') as f:
+            f.write(text.encode('utf-8'))
+        try:
+            os.rename(temp, filename)
+        except OSError:
+            # On platforms where `rename` won't replace an existing file, the
+            # entry has just been stored by someone else.
+            os.remove(temp)
+
+    def prune(self):
+        """
+        Evict the least recently used entries until the cache is below its
+        size limit again. Nothing is done if no entry has been added since
+        the last time.
+        """
+        stamp = path.join(self.directory, PRUNE_STAMP)
+        try:
+            pruned = os.stat(stamp).st_mtime
+        except OSError:
+            pruned = None
+        if pruned is not None and not self._changed_since(pruned):
+            return
+        # Touch the stamp first, so that entries added while we walk the
+        # cache are looked at next time.
+        if not _touch(stamp):
+            return
+
+        entries = []
+        total = 0
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                if filename == PRUNE_STAMP:
+                    continue
+                full_path = path.join(dirpath, filename)
+                try:
+                    stat = os.stat(full_path)
+                except OSError:
+                    continue
+                if filename.startswith(TEMP_PREFIX):
+                    if now - stat.st_mtime > STALE_TEMP_AGE:
+                        _remove(full_path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, full_path))
+                total += stat.st_size
+
+        if total <= self.max_size:
+            return
+
+        entries.sort()
+        for _, size, full_path in entries:
+            if total <= self.max_size * LOW_WATER_MARK:
+                break
+            _remove(full_path)
+            total -= size
+        # What we removed is not something added.
+        _touch(stamp)
+
+    def _changed_since(self, when):
+        """
+        Has a directory of the cache changed since the time `when`? Adding
+        an entry changes the directory it is renamed into, and the cache
+        itself when that directory is new.
+        """
+        try:
+            names = os.listdir(self.directory)
+            if os.stat(self.directory).st_mtime >= when:
+                return True
+        except OSError:
+            return False
+        for name in names:
+            if name == PRUNE_STAMP:
+                continue
+            try:
+                if os.stat(path.join(self.directory, name)).st_mtime >= when:
+                    return True
+            except OSError:
+                continue
+        return False
+
+
+def _touch(filename):
+    try:
+        with open(filename, 'ab'):
+            os.utime(filename, None)
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _remove(filename):
+    try:
+        os.remove(filename)
+    except OSError:
+        pass
+
+
+_renderer_version = None
+
+
+def renderer_version():
+    """
+    Identify the versions of everything that renders a section, so that
+    upgrading any of them starts from a clean slate.
+    """
+    global _renderer_version
+    if _renderer_version is None:
+        import markdown
+        import pygments
+        from pycco import __version__
+        _renderer_version = 'pycco-{} pygments-{} markdown-{}'.format(
+            __version__, pygments.__version__,
+            getattr(markdown, '__version__', None) or markdown.version)
+    return _renderer_version
+
+
+def _hash(*parts):
+    digest = hashlib.sha1()
+    for part in parts:
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def docs_key(docs_text):
+    """
+    The cache key for the rendered docs of a section. Docs render the same way
+    in every language and every file, so only their text matters.
+    """
+    return _hash('docs', renderer_version(), docs_text)
+
+
+def code_keys(sections, language):
+    """
+    The cache keys for the highlighted code of each section.
+
+    How Pygments highlights a section can depend on the code before it, so
+    each key chains in the key of the section before it. A section is only
+    served from the cache when everything above it in the file matches too;
+    in practice that is any identical file, or the identical head of a file.
+    """
+    keys = []
+    key = _hash('code', renderer_version(), language["name"])
+    for section in sections:
+        key = _hash(key, section["code_text"].rstrip())
+        keys.append(key)
+    return keys
@@ -9,3 +9,23 @@ def compat_items(d):
         return d.iteritems()
     except AttributeError:
         return d.items()
+
+
+try:
+    from os import scandir as pycco_scandir
+except ImportError:
+    import os
+
+    class _DirEntry(object):
+        def __init__(self, directory, name):
+            self.name = name
+            self.path = os.path.join(directory, name)
+
+        def is_dir(self):
+            return os.path.isdir(self.path)
+
+        def is_symlink(self):
+            return os.path.islink(self.path)
+
+    def pycco_scandir(directory):
+        return [_DirEntry(directory, name) for name in os.listdir(directory)]
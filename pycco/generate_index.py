@@ -2,14 +2,17 @@
 This is the module responsible for automatically generating an HTML index of
 all documentation files generated by Pycco.
 """
-import re
 from os import path
 
 from pycco.compat import compat_items
 from pycco_resources import pycco_template
 
 
-__all__ = ('generate_index',)
+__all__ = ('generate_index', 'generate_index_pages')
+
+# The key a node of the tree keeps its file's entry under, which unlike a
+# name such as 'entry', no step of a path can be.
+_ENTRY = None
 
 
 def build_tree(file_paths, outdir):
@@ -39,7 +42,7 @@ def add_file(entry, path_steps, tree):
         add_file(entry, subpath, tree[node])
 
     else:
-        tree[node]['entry'] = entry
+        tree[node][_ENTRY] = entry
 
 
 def generate_tree_html(tree):
@@ -48,9 +51,11 @@ def generate_tree_html(tree):
     those paths.
     """
     items = []
-    for node, subtree in sorted(compat_items(tree)):
-        if 'entry' in subtree:
-            html = u'<li><a href="{}">{}</a></li>'.format(subtree['entry']['relpath'], node)
+    nodes = [(node, subtree) for node, subtree in compat_items(tree)
+             if node is not _ENTRY]
+    for node, subtree in sorted(nodes):
+        if _ENTRY in subtree:
+            html = u'<li><a href="{}">{}</a></li>'.format(subtree[_ENTRY]['relpath'], node)
         else:
             html = u'<dl><dt>{}</dt><dd><ul>{}</ul></dd></dl>'.format(
                 node, generate_tree_html(subtree)
@@ -68,11 +73,87 @@ def generate_index(files, outdir):
     """
     tree = build_tree(files, outdir)
 
-    rendered = pycco_template({
+    return pycco_template({
         "title": 'Index',
         "stylesheet": 'pycco.css',
         "sections": {'docs_html': generate_tree_html(tree)},
         "source": '',
-    })
+    }).encode("utf-8")
+
+
+# === Sharded indexes ===
+#
+# With a hundred thousand files, a single index page runs to tens of
+# megabytes. A sharded index instead has one small page per directory of the
+# output, listing its subdirectories and files, with breadcrumb links back up
+# to the top. The directories are gathered in a single pass over the paths, so
+# however deep the tree, nothing recurses.
+#
+# The pages are named `_index.html` rather than `index.html`, which is the
+# documentation of any `index.js` or `index.py`.
+
+INDEX_NAME = '_index.html'
 
-    return re.sub(r"__DOUBLE_OPEN_STACHE__", "{{", rendered).encode("utf-8")
+
+def build_directories(file_paths, outdir):
+    """
+    Map the path of each directory of the output, relative to `outdir` and
+    with `''` for `outdir` itself, to the sets of its subdirectories' and
+    files' names.
+    """
+    directories = {'': (set(), set())}
+    for file_path in file_paths:
+        steps = path.relpath(file_path, outdir).split(path.sep)
+        parent = ''
+        for step in steps[:-1]:
+            directory = path.join(parent, step)
+            if directory not in directories:
+                directories[directory] = (set(), set())
+                directories[parent][0].add(step)
+            parent = directory
+        directories[parent][1].add(steps[-1])
+    return directories
+
+
+def generate_directory_html(directory, subdirectories, files, outdir):
+    """
+    The index page of one directory of the output.
+    """
+    steps = directory.split(path.sep) if directory else []
+    depth = len(steps)
+    top = path.basename(outdir) or outdir
+    crumbs = [u'<a href="{}{}">{}</a>'.format('../' * depth, INDEX_NAME, top)]
+    for i, step in enumerate(steps):
+        crumbs.append(u'<a href="{}{}">{}</a>'.format(
+            '../' * (depth - i - 1), INDEX_NAME, step))
+
+    items = [u'<li><a href="{0}/{1}">{0}/</a></li>'.format(name, INDEX_NAME)
+             for name in sorted(subdirectories)]
+    items.extend(u'<li><a href="{0}">{0}</a></li>'.format(name)
+                 for name in sorted(files))
+
+    return pycco_template({
+        "title": u'Index of {}'.format(directory.replace(path.sep, '/') or '/'),
+        "stylesheet": '../' * depth + 'pycco.css',
+        "sections": {'docs_html': u'<p>{}</p><ul>{}</ul>'.format(
+            u' / '.join(crumbs), u''.join(items))},
+        "source": '',
+    }).encode("utf-8")
+
+
+def generate_index_pages(files, outdir):
+    """
+    Given a list of generated documentation files, yield the path and HTML
+    of the index page of each directory they are in. Raises `ValueError`
+    rather than overwrite the documentation of a source named like an index
+    page.
+    """
+    directories = build_directories(files, outdir)
+    for directory, (_, names) in compat_items(directories):
+        if INDEX_NAME in names:
+            raise ValueError(u'The index would overwrite {}'.format(
+                path.join(outdir, directory, INDEX_NAME)))
+    for directory in sorted(directories):
+        subdirectories, names = directories[directory]
+        yield (path.join(outdir, directory, INDEX_NAME),
+               generate_directory_html(directory, subdirectories, names, outdir))
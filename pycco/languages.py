@@ -4,7 +4,7 @@ the name of the Pygments lexer and the symbol that indicates a comment. To
 add another language to Pycco's repertoire, add it here.
 """
 
-__all__ = ("supported_languages",)
+__all__ = ("supported_languages", "supported_filenames", "language_aliases")
 
 HASH = "#"
 SLASH_STAR = "/*"
@@ -74,3 +74,49 @@ supported_languages = {
     ".do": lang("stata", SLASH_SLASH, SLASH_STAR, STAR_SLASH)
 
 }
+
+# Files that are recognised by their whole name rather than an extension.
+ruby_lang = supported_languages[".rb"]
+python_lang = supported_languages[".py"]
+bash_lang = supported_languages[".sh"]
+make_lang = lang("make", HASH)
+
+supported_filenames = {
+    "Makefile": make_lang,
+    "makefile": make_lang,
+    "GNUmakefile": make_lang,
+
+    "Rakefile": ruby_lang,
+    "Gemfile": ruby_lang,
+    "Vagrantfile": ruby_lang,
+
+    "SConstruct": python_lang,
+    "SConscript": python_lang,
+    "wscript": python_lang,
+
+    ".bashrc": bash_lang,
+    ".bash_profile": bash_lang,
+    ".profile": bash_lang,
+}
+
+# Other names for languages, as found in `#!` lines and editor modelines,
+# mapped to the name of their entry above.
+language_aliases = {
+    "sh": "bash",
+    "dash": "bash",
+    "ksh": "bash",
+    "zsh": "bash",
+    "node": "javascript",
+    "nodejs": "javascript",
+    "js": "javascript",
+    "coffee": "coffee-script",
+    "c++": "cpp",
+    "rscript": "r",
+    "tclsh": "tcl",
+    "wish": "tcl",
+    "escript": "erlang",
+    "runhaskell": "haskell",
+    "runghc": "haskell",
+    "octave": "matlab",
+    "makefile": "make",
+}
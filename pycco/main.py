@@ -45,20 +45,31 @@ Or, to install the latest source
 
 from __future__ import absolute_import, print_function
 
-# Import our external dependencies.
+# Import our external dependencies. Pygments and Markdown take a while to load,
+# so they are only imported once there is something to highlight or render.
 import argparse
+import contextlib
+import io
+import itertools
+import json
 import os
 import re
 import sys
+import threading
 import time
+from fnmatch import fnmatch
 from os import path
 
-import pygments
-from pygments import formatters, lexers
-
-from markdown import markdown
-from pycco.generate_index import generate_index
-from pycco.languages import supported_languages
+from pycco import __version__
+from pycco.cache import DEFAULT_MAX_SIZE, SectionCache, code_keys, docs_key
+from pycco.compat import pycco_scandir
+from pycco.generate_index import generate_index, generate_index_pages
+from pycco.manifest import (is_current, load_manifest, manifest_key,
+                            source_hash, update_manifest)
+from pycco.output import (COMPRESSED_SUFFIXES, compress_file, minify_css,
+                          minify_html, write_file)
+from pycco import profiling
+from pycco.languages import language_aliases, supported_filenames, supported_languages
 from pycco_resources import css as pycco_css
 # This module contains all of our static resources.
 from pycco_resources import pycco_template
@@ -67,30 +78,77 @@ from pycco_resources import pycco_template
 
 
 def generate_documentation(source, outdir=None, preserve_paths=True,
-                           language=None, encoding="utf8"):
+                           language=None, encoding="utf8", cache=None, jobs=1):
     """
     Generate the documentation for a source file by reading it in, splitting it
     up into comment/code sections, highlighting them for the appropriate
     language, and merging them into an HTML template.
+
+    With more than one job, a source of at least `chunk_threshold` characters
+    is highlighted and rendered in chunks on a pool of that many processes.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
     code = open(source, "rb").read().decode(encoding)
-    return _generate_documentation(source, code, outdir, preserve_paths, language)
+    if jobs == 1 or len(code) < chunk_threshold:
+        return _generate_documentation(source, code, outdir, preserve_paths,
+                                       language, cache=cache)
 
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs)
+    try:
+        return _generate_documentation(source, code, outdir, preserve_paths,
+                                       language, cache=cache, pool=pool)
+    finally:
+        pool.terminate()
+        pool.join()
 
-def _generate_documentation(file_path, code, outdir, preserve_paths, language):
+
+def _generate_documentation(file_path, code, outdir, preserve_paths, language,
+                            cache=None, pool=None):
     """
     Helper function to allow documentation generation without file handling.
     """
-    language = get_language(file_path, code, language_name=language)
-    sections = parse(code, language)
-    highlight(sections, language, preserve_paths=preserve_paths, outdir=outdir)
+    sections = _document_sections(file_path, code, outdir, preserve_paths,
+                                  language, cache=cache, pool=pool)
     return generate_html(file_path, sections, preserve_paths=preserve_paths, outdir=outdir)
 
 
-def parse(code, language):
+def _document_sections(file_path, code, outdir, preserve_paths, language,
+                       cache=None, pool=None, kept=None, links=None):
+    """
+    Parse and highlight `code`, returning the sections ready for the page.
+    Given a process `pool`, huge sources are highlighted in parallel chunks.
+
+    `kept` is a dictionary to keep the language and sections of each file in
+    from one build to the next, as watch mode does, so that only the sections
+    that changed since the last build are rendered again.
+    """
+    with profiling.phase("language"):
+        language = get_language(file_path, code, language_name=language)
+    with profiling.phase("parse"):
+        sections = parse(code, language,
+                         symbols=links["defined"] if links is not None else None)
+    if pool is not None and len(code) >= chunk_threshold:
+        return _highlight_in_chunks(sections, language, pool,
+                                    preserve_paths=preserve_paths, outdir=outdir,
+                                    links=links)
+
+    previous = None
+    if kept is not None and file_path in kept:
+        previous_language, previous = kept[file_path]
+        if previous_language is not language:
+            previous = None
+    sections = highlight(sections, language, preserve_paths=preserve_paths,
+                         outdir=outdir, cache=cache, previous=previous,
+                         links=links)
+    if kept is not None:
+        kept[file_path] = (language, sections)
+    return sections
+
+
+def parse(code, language, symbols=None):
     """
     Given a string of source code, parse out each comment and the code that
     follows it, and create an individual **section** for it.
@@ -102,21 +160,39 @@ def parse(code, language):
           "code_html": ...,
           "num":       ...
         }
+
+    The source is read in a single pass. The docs and code of the section
+    being built are collected as lists of lines and only joined when the
+    section is saved, so even huge files parse in linear time.
+
+    Pass a list as `symbols` to collect the `def` and `class` lines of the
+    code, as `(indent, line, section number)` tuples, for the symbol index.
+    Other code lines that end the blocks of those before them, like a `try:`
+    or an `if` at the top level, are collected with an empty `line`.
     """
 
+    compile_language(language)
     lines = code.split("\n")
     sections = []
-    has_code = docs_text = code_text = ""
 
     if lines[0].startswith("#!"):
         lines.pop(0)
 
     if language["name"] == "python":
         for linenum, line in enumerate(lines[:2]):
-            if re.search(r'coding[:=]\s*([-\w.]+)', lines[linenum]):
+            if coding_matcher.search(line):
                 lines.pop(linenum)
                 break
 
+    # The docs and code of the current section, as lists of lines that each
+    # end in a newline, along with a few facts about them that would
+    # otherwise have to be recomputed from the joined text: whether any docs
+    # line is more than whitespace, and the first character of the code.
+    docs, code_lines = [], []
+    docs_blank = True
+    code_head = ""
+    has_code = False
+
     def save(docs, code):
         if docs or code:
             sections.append({
@@ -128,23 +204,28 @@ def parse(code, language):
     multi_line = False
     multi_string = False
     multistart, multiend = language.get("multistart"), language.get("multiend")
+    delimiters = (multistart, multiend) if multistart and multiend else ()
     comment_matcher = language['comment_matcher']
+    indent = 0
 
     for line in lines:
         process_as_code = False
+        lstripped = line.lstrip()
+        rstripped = line.rstrip()
+
         # Only go into multiline comments section when one of the delimiters is
         # found to be at the start of a line
-        if multistart and multiend \
-           and any(line.lstrip().startswith(delim) or line.rstrip().endswith(delim)
-                   for delim in (multistart, multiend)):
+        if delimiters and any(lstripped.startswith(delim) or rstripped.endswith(delim)
+                              for delim in delimiters):
             multi_line = not multi_line
+            stripped = lstripped.rstrip()
 
             if multi_line \
-               and line.strip().endswith(multiend) \
-               and len(line.strip()) > len(multiend):
+               and stripped.endswith(multiend) \
+               and len(stripped) > len(multiend):
                 multi_line = False
 
-            if not line.strip().startswith(multistart) and not multi_line \
+            if not stripped.startswith(multistart) and not multi_line \
                or multi_string:
 
                 process_as_code = True
@@ -160,48 +241,70 @@ def parse(code, language):
                 # docs
                 line = line.replace(multistart, '')
                 line = line.replace(multiend, '')
-                docs_text += line.strip() + '\n'
-                indent_level = re.match(r"\s*", line).group(0)
+                text = line.strip()
+                docs.append(text + '\n')
+                docs_blank = docs_blank and not text
+                indent = len(line) - len(line.lstrip())
 
-                if has_code and docs_text.strip():
-                    save(docs_text, code_text[:-1])
-                    code_text = code_text.split('\n')[-1]
-                    has_code = docs_text = ''
+                if has_code and not docs_blank:
+                    save("".join(docs), "".join(code_lines)[:-1])
+                    docs, code_lines = [], []
+                    docs_blank, code_head, has_code = True, "", False
 
         elif multi_line:
             # Remove leading spaces
-            if re.match(r' {{{:d}}}'.format(len(indent_level)), line):
-                docs_text += line[len(indent_level):] + '\n'
-            else:
-                docs_text += line + '\n'
-
-        elif re.match(comment_matcher, line):
-            if has_code:
-                save(docs_text, code_text)
-                has_code = docs_text = code_text = ''
-            docs_text += re.sub(comment_matcher, "", line) + "\n"
+            if line.startswith(" " * indent):
+                line = line[indent:]
+            docs.append(line + '\n')
+            docs_blank = docs_blank and not line.strip()
 
         else:
-            process_as_code = True
+            comment = comment_matcher.match(line)
+            if comment:
+                if has_code:
+                    save("".join(docs), "".join(code_lines))
+                    docs, code_lines = [], []
+                    docs_blank, code_head, has_code = True, "", False
+                text = line[comment.end():]
+                docs.append(text + "\n")
+                docs_blank = docs_blank and not text.strip()
+            else:
+                process_as_code = True
 
         if process_as_code:
-            if code_text and any(line.lstrip().startswith(x)
-                                 for x in ['class ', 'def ', '@']):
-                if not code_text.lstrip().startswith("@"):
-                    save(docs_text, code_text)
-                    code_text = has_code = docs_text = ''
+            if lstripped.startswith(('class ', 'def ', '@')):
+                if code_lines and code_head != "@":
+                    save("".join(docs), "".join(code_lines))
+                    docs, code_lines = [], []
+                    docs_blank, code_head = True, ""
+                if symbols is not None and lstripped[0] != "@":
+                    symbols.append((len(line) - len(lstripped), lstripped,
+                                    len(sections)))
+            elif symbols and lstripped and not lstripped.startswith((")", "]", "}")):
+                # Only a line indented no deeper than the last one collected
+                # can end a block, and closing brackets belong to the line
+                # they close.
+                line_indent = len(line) - len(lstripped)
+                if line_indent <= symbols[-1][0]:
+                    symbols.append((line_indent, "", len(sections)))
 
             has_code = True
-            code_text += line + '\n'
+            code_lines.append(line + '\n')
+            if not code_head and lstripped:
+                code_head = lstripped[0]
 
-    save(docs_text, code_text)
+    save("".join(docs), "".join(code_lines))
 
     return sections
 
+
+# Python's encoding declaration, which only belongs in the first two lines.
+coding_matcher = re.compile(r'coding[:=]\s*([-\w.]+)')
+
 # === Preprocessing the comments ===
 
 
-def preprocess(comment, preserve_paths=True, outdir=None):
+def preprocess(comment, preserve_paths=True, outdir=None, links=None):
     """
     Add cross-references before having the text processed by markdown.  It's
     possible to reference another file, like this : `[[main.py]]` which renders
@@ -211,103 +314,642 @@ def preprocess(comment, preserve_paths=True, outdir=None):
     declared; they are written on a single line, and surrounded by equals
     signs:
     `=== like this ===`
+
+    During a build, `links` holds the link table of the build and the page
+    being rendered; references are resolved through the table, and both the
+    references and the sections found are recorded there for `--check-links`.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
 
-    def sanitize_section_name(name):
-        return "-".join(name.lower().strip().split(" "))
-
     def replace_crossref(match):
         # Check if the match contains an anchor
         if '#' in match.group(1):
             name, anchor = match.group(1).split('#')
-            return " [{}]({}#{})".format(name,
-                                         path.basename(destination(name,
-                                                                   preserve_paths=preserve_paths,
-                                                                   outdir=outdir)),
-                                         anchor)
+        else:
+            name, anchor = match.group(1), None
 
+        if links is None:
+            href = path.basename(destination(name, preserve_paths=preserve_paths,
+                                             outdir=outdir))
         else:
-            return " [{}]({})".format(match.group(1),
-                                      path.basename(destination(match.group(1),
-                                                                preserve_paths=preserve_paths,
-                                                                outdir=outdir)))
+            href = _resolve_crossref(links, name, anchor, preserve_paths, outdir)
+
+        if anchor is None:
+            return " [{}]({})".format(name, href)
+        return " [{}]({}#{})".format(name, href, anchor)
 
     def replace_section_name(match):
         """
         Replace equals-sign-formatted section names with anchor links.
         """
+        anchor = sanitize_section_name(match.group(2))
+        if links is not None:
+            links["anchors"].append(anchor)
         return '{lvl} <span id="{id}" href="{id}">{name}</span>'.format(
-            lvl=re.sub('=', '#', match.group(1)),
-            id=sanitize_section_name(match.group(2)),
+            lvl=match.group(1).replace('=', '#'),
+            id=anchor,
             name=match.group(2)
         )
 
-    comment = re.sub(r'^([=]+)([^=]+)[=]*\s*$', replace_section_name, comment)
-    comment = re.sub(r'(?<!`)\[\[(.+?)\]\]', replace_crossref, comment)
+    comment = section_name_matcher.sub(replace_section_name, comment, 1)
+    comment = crossref_matcher.sub(replace_crossref, comment)
 
     return comment
 
+
+# A `=== section name ===` line, which may only start a comment.
+section_name_matcher = re.compile(r'^([=]+)([^=]+)[=]*\s*$')
+
+# A `[[file]]` or `[[file#anchor]]` cross-reference, unless quoted as code.
+crossref_matcher = re.compile(r'(?<!`)\[\[(.+?)\]\]')
+
+
+def sanitize_section_name(name):
+    return "-".join(name.lower().strip().split(" "))
+
+
+# === Cross-references ===
+#
+# A build resolves `[[file]]` references through a link table, mapping the
+# names a source can be referred to by, its path and its bare file name, to
+# the path of its page. A path is looked up relative to the directory of the
+# referring source first, and then as it is given. The table is made once
+# per build from the sources being documented and those already listed in
+# the build manifest, so each reference is a single lookup, and links
+# between pages in different directories point the right way.
+#
+# While rendering, the references on each page and the sections it declares
+# are recorded in the manifest, so that `--check-links` can tell which
+# references dangle without rendering anything again.
+
+def build_link_table(sources, preserve_paths=True, outdir=None, manifest=None):
+    """
+    Map the names `sources` can be referred to by to the paths of their pages.
+    """
+    table = {}
+    entries = manifest["files"] if manifest else {}
+    for source, dest in itertools.chain(
+            ((s, entries[s]["dest"]) for s in sorted(entries)),
+            ((s, destination(s, preserve_paths=preserve_paths, outdir=outdir))
+             for s in sources)):
+        dest = path.normpath(dest)
+        table[path.normpath(source).replace(os.sep, "/")] = dest
+        table.setdefault(path.basename(source), dest)
+    return table
+
+
+def _lookup_page(table, name, source):
+    """
+    The page of the file `name` refers to from `source`, or `None`.
+    """
+    name = path.normpath(name)
+    for key in (path.normpath(path.join(path.dirname(source), name)), name):
+        dest = table.get(key.replace(os.sep, "/"))
+        if dest is not None:
+            return dest
+    return None
+
+
+def _resolve_crossref(links, name, anchor, preserve_paths, outdir):
+    """
+    Look `name` up in the link table, or else in the symbol table, recording
+    the reference, and return the link to its page from the page being
+    rendered.
+    """
+    dest = _lookup_page(links["table"], name, links["source"])
+    suffix = ""
+    if dest is None and anchor is None and name in links["symbols"]:
+        dest, num = links["symbols"][name]
+        anchor = "section-{}".format(num)
+        suffix = "#" + anchor
+    links["refs"].append([name, anchor, dest])
+    if dest is None:
+        return path.basename(destination(name, preserve_paths=preserve_paths,
+                                         outdir=outdir))
+    return path.relpath(dest, path.dirname(links["page"])).replace(os.sep, "/") + suffix
+
+
+# === Symbols ===
+#
+# `[[module.Class.method]]` links to the section where `method` is defined.
+# `parse` notes the `def` and `class` lines it comes across, and the lines
+# that end their blocks, so that they are given their qualified names by
+# indentation, and stored with the section numbers in the build manifest.
+# The symbol table is built from the manifest, and written to `outdir` as
+# compact JSON for other tools to use; only the files that were rendered
+# again contribute new symbols to it.
+
+SYMBOLS_NAME = "pycco-symbols.json"
+
+symbol_matcher = re.compile(r"(?:def|class)\s+(\w+)")
+
+
+def qualify_symbols(symbols):
+    """
+    Turn the `(indent, line, section number)` tuples collected by `parse`
+    into `[qualified name, section number]` pairs, qualified by the classes
+    and functions they are nested in. Any other line ends the blocks it is
+    indented no deeper than.
+    """
+    qualified = []
+    stack = []
+    for indent, line, num in symbols:
+        while stack and stack[-1][0] >= indent:
+            stack.pop()
+        match = symbol_matcher.match(line)
+        if match is None:
+            continue
+        stack.append((indent, match.group(1)))
+        qualified.append([".".join(name for _, name in stack), num])
+    return qualified
+
+
+def module_names(source):
+    """
+    The dotted module names a source can be referred to by: its whole path,
+    and its bare name.
+    """
+    steps = [step for step in path.splitext(path.normpath(source))[0].split(os.sep)
+             if step not in ("", os.curdir, os.pardir)]
+    return [".".join(steps), steps[-1]]
+
+
+def build_symbol_table(entries):
+    """
+    Map the qualified names of the symbols listed in the manifest `entries`
+    to their pages and section numbers.
+    """
+    table = {}
+    for source in sorted(entries):
+        entry = entries[source]
+        names = module_names(source)
+        for symbol, num in entry.get("symbols", ()):
+            table["{}.{}".format(names[0], symbol)] = (entry["dest"], num)
+            table.setdefault("{}.{}".format(names[1], symbol), (entry["dest"], num))
+    return table
+
+
+def _write_symbols(outdir, table):
+    """
+    Write the symbol table to `outdir`, with pages relative to it.
+    """
+    data = dict((name, [path.relpath(dest, outdir).replace(os.sep, "/"), num])
+                for name, (dest, num) in table.items())
+    write_file(path.join(outdir, SYMBOLS_NAME), json.dumps(
+        data, sort_keys=True, separators=(",", ":")).encode("utf-8"))
+
+
+def _is_symbol_ref(ref, source, table):
+    """
+    Is the recorded reference `ref` from `source` to a symbol, rather than
+    to a file? A symbol reference is recorded with the anchor of the section
+    it resolved to, and an unresolved one without an anchor.
+    """
+    name, anchor, dest = ref
+    if _lookup_page(table, name, source) is not None:
+        return False
+    if anchor is None:
+        return True
+    return dest is not None and section_anchor_matcher.match(anchor) is not None
+
+
+def _ref_target(ref, source, table, symbols):
+    """
+    The `(anchor, dest)` the recorded reference `ref` from `source` would be
+    resolved to now, through the link and symbol tables.
+    """
+    name, anchor, dest = ref
+    page = _lookup_page(table, name, source)
+    if page is not None:
+        return anchor, page
+    if not _is_symbol_ref(ref, source, table):
+        return anchor, None
+    if name not in symbols:
+        return None, None
+    page, num = symbols[name]
+    return "section-{}".format(num), page
+
+
+def _is_stale(entry, source, table, symbols):
+    """
+    Would any reference recorded in the manifest `entry` of `source` be
+    resolved differently now?
+    """
+    return any(_ref_target(ref, source, table, symbols) != (ref[1], ref[2])
+               for ref in entry["refs"])
+
+
+# The anchor every section of a page has, by its number.
+section_anchor_matcher = re.compile(r"section-\d+$")
+
+
+def find_broken_links(manifest):
+    """
+    Find the references in the documentation listed by `manifest` to files,
+    sections or symbols that do not exist, as `(source, reference, problem)`
+    tuples. References to symbols that have moved since their page was
+    rendered are reported too.
+    """
+    entries = manifest["files"]
+    anchors = dict((entry["dest"], set(entry.get("anchors", ())))
+                   for entry in entries.values())
+    table = build_link_table([], manifest=manifest)
+    symbols = build_symbol_table(entries)
+    broken = []
+    for source in sorted(entries):
+        for ref in entries[source].get("refs", ()):
+            name, anchor, dest = ref
+            reference = name if anchor is None else name + "#" + anchor
+            if dest is None:
+                broken.append((source, name, "no such file or symbol"))
+            elif dest not in anchors:
+                broken.append((source, reference, "no such file"))
+            elif anchor is not None and _is_symbol_ref(ref, source, table):
+                if name not in symbols:
+                    broken.append((source, name, "no such symbol"))
+                elif _ref_target(ref, source, table, symbols) != (anchor, dest):
+                    broken.append((source, name, "symbol has moved"))
+            elif anchor is not None and anchor not in anchors[dest]:
+                if not section_anchor_matcher.match(anchor):
+                    broken.append((source, reference, "no such section"))
+    return broken
+
+
 # === Highlighting the source code ===
 
 
-def highlight(sections, language, preserve_paths=True, outdir=None):
+def highlight(sections, language, preserve_paths=True, outdir=None, cache=None,
+              previous=None, links=None):
     """
     Highlights a single chunk of code using the **Pygments** module, and runs
     the text of its corresponding comment through **Markdown**.
 
-    We process the entire file in a single call to Pygments by inserting little
-    marker comments between each section and then splitting the result string
-    wherever our markers occur.
+    We lex the code of the entire file in a single pass, and cut the stream of
+    tokens at the boundaries between sections, so that each section's code is
+    highlighted in the context of the whole file.
+
+    With a `SectionCache`, rendered docs are looked up section by section, and
+    Pygments is skipped altogether when the highlighted code of every section
+    is already cached.
+
+    Given the `previous` highlighted sections of an earlier version of the
+    same file, only the sections that changed since are rendered again.
+    Cross-references are resolved through `links`, as in `preprocess`.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument.")
 
-    divider_text = language["divider_text"]
-    lexer = language["lexer"]
-    divider_html = language["divider_html"]
+    compile_language(language)
+    code_html = None
+    previous_docs = {}
+    if previous is not None:
+        with profiling.phase("pygments"):
+            code_html = _rehighlight_code(sections, previous, language)
+        previous_docs = dict((s["docs_text"], s["docs_html"]) for s in previous)
+    elif cache is not None:
+        keys = code_keys(sections, language)
+        code_html = [cache.get(key) for key in keys]
+        if None in code_html:
+            code_html = None
+
+    if code_html is None:
+        with profiling.phase("pygments"):
+            code_html = _highlight_code(sections, language)
+        if cache is not None:
+            for key, html in zip(keys, code_html):
+                cache.put(key, html)
+
+    with profiling.phase("markdown"):
+        for i, section in enumerate(sections):
+            section["code_html"] = code_html[i]
+            docs_text = section["docs_text"]
+            if isinstance(docs_text, bytes):
+                docs_text = docs_text.decode('utf-8')
+
+            # Docs with cross-references or a section name go through
+            # `preprocess` on every build, to resolve and record them.
+            linked = links is not None and (
+                "[[" in docs_text or docs_text.startswith("="))
+            docs_html = None if linked else previous_docs.get(section["docs_text"])
+            if docs_html is not None:
+                section["docs_html"] = docs_html
+                section["num"] = i
+                continue
+
+            docs_html = plain_text_html(docs_text)
+            if docs_html is None and cache is not None and not linked:
+                key = docs_key(docs_text)
+                docs_html = cache.get(key)
+            if docs_html is None:
+                docs_html = render_markdown(
+                    preprocess(
+                        docs_text,
+                        preserve_paths=preserve_paths,
+                        outdir=outdir,
+                        links=links
+                    )
+                )
+                if cache is not None and not linked:
+                    cache.put(key, docs_html)
+            section["docs_html"] = docs_html
+            section["num"] = i
 
-    joined_text = divider_text.join(
-        section["code_text"].rstrip() for section in sections
-    )
-    html_formatter = formatters.get_formatter_by_name("html")
-
-    output = pygments.highlight(
-        joined_text, lexer, html_formatter
-    ).replace(
-        highlight_start, ""
-    ).replace(
-        highlight_end, ""
+    return sections
+
+
+# The Markdown extensions we render comments with.
+markdown_extensions = [
+    'markdown.extensions.smarty',
+    'markdown.extensions.fenced_code',
+    'markdown.extensions.footnotes',
+]
+
+# Building a `Markdown` instance loads all of its extensions, which costs more
+# than rendering a typical comment, so each thread builds one and keeps it.
+_markdown_engines = threading.local()
+
+
+def render_markdown(text):
+    """
+    Render `text` through Markdown, reusing this thread's `Markdown` instance.
+    Resetting it between sections clears footnotes and link references, so
+    every section renders exactly as it would on a fresh instance.
+
+    Sections are deliberately not batched into a single conversion: footnotes
+    and reference links are document-wide in Markdown, and would leak from one
+    section into the next.
+    """
+    engine = getattr(_markdown_engines, "engine", None)
+    if engine is None:
+        from markdown import Markdown
+        engine = _markdown_engines.engine = Markdown(
+            extensions=markdown_extensions)
+    return engine.reset().convert(text)
+
+
+# A line of docs that Markdown, SmartyPants and `preprocess()` would all leave
+# alone: words, spaces and a little punctuation, with no digit at the start
+# that might begin a numbered list, and ampersands only where they can't start
+# an entity.
+plain_text_line = re.compile(r"(?!\d)(?:[^\W_]|[ ,.;:?!()/]|&(?= ))*\Z")
+
+
+def plain_text_html(text):
+    """
+    Most comments are a sentence or two of plain text, and rendering those
+    through Markdown only wraps them in paragraphs. When `text` is that plain,
+    build the same HTML directly and return it; otherwise return `None`.
+    """
+    paragraphs = []
+    lines = []
+    for line in text.split("\n"):
+        if not line.strip(" "):
+            if lines:
+                paragraphs.append(lines)
+                lines = []
+            continue
+        # Leading spaces may start a code block, trailing ones a line break,
+        # and SmartyPants turns `...` into an ellipsis.
+        if line[0] == " " or line[-1] == " " or ".." in line \
+           or not plain_text_line.match(line):
+            return None
+        lines.append(line)
+    if lines:
+        paragraphs.append(lines)
+
+    return "\n".join(
+        "<p>{}</p>".format("\n".join(lines).replace("&", "&amp;"))
+        for lines in paragraphs
     )
-    fragments = re.split(divider_html, output)
 
+
+def _highlight_code(sections, language):
+    """
+    Highlight the code of every section in a single pass of the lexer,
+    returning the `code_html` of each section.
+
+    The code of all sections is lexed as one text, so each section is
+    highlighted in the context of the code around it. The stream of tokens is
+    then cut wherever one section ends and the next begins, and each section
+    is formatted from its own slice of tokens. Blank lines around a section's
+    code are left out of its slice.
+    """
+    lexer = get_lexer(language)
+
+    # Pygments drops a byte order mark at the start of its input, turns
+    # `\r\n` and `\r` into `\n`, and drops the newlines at the start, so do
+    # the same before measuring offsets.
+    texts = [section["code_text"].rstrip().replace("\r\n", "\n").replace("\r", "\n")
+             for section in sections]
+    joined = "\n".join(texts)
+    lexed = joined[1:] if joined.startswith(u"\ufeff") else joined
+    offset = len(lexed.lstrip("\n")) - len(joined)
+
+    spans = []
+    for text in texts:
+        spans.append((offset + len(text) - len(text.lstrip("\n")),
+                      offset + len(text)))
+        offset += len(text) + 1
+
+    slices = [[] for _ in spans]
+    i = position = 0
+    for token_type, value in lexer.get_tokens(joined):
+        end = position + len(value)
+        j = i
+        while j < len(spans) and spans[j][0] < end:
+            start, stop = max(spans[j][0], position), min(spans[j][1], end)
+            if start < stop:
+                slices[j].append((token_type, value[start - position:stop - position]))
+            j += 1
+        while i < len(spans) and spans[i][1] <= end:
+            i += 1
+        position = end
+
+    formatter = _html_formatter()
+    code_html = []
+    for tokens in slices:
+        output = io.StringIO()
+        formatter.format(tokens, output)
+        # The formatter ends the last line of a slice with a newline of its
+        # own, which isn't part of the section.
+        code_html.append(highlight_start + output.getvalue()[:-1] + highlight_end)
+    return code_html
+
+
+_html_formatters = threading.local()
+
+
+def _html_formatter():
+    """
+    Get this thread's Pygments HTML formatter, which leaves wrapping the
+    highlighted code in `highlight_start` and `highlight_end` to us.
+    """
+    formatter = getattr(_html_formatters, "formatter", None)
+    if formatter is None:
+        from pygments.formatters import HtmlFormatter
+        formatter = _html_formatters.formatter = HtmlFormatter(nowrap=True)
+    return formatter
+
+
+def _rehighlight_code(sections, previous, language):
+    """
+    Highlight the code of `sections`, reusing the highlighted code of the
+    `previous` sections of the same file wherever it cannot have changed.
+
+    Everything before the first section whose code changed, and after the
+    last one, is left alone. The changed run is widened to start and end at
+    `_chunk_starts` of both versions of the file, where the lexer is known to
+    be in its initial state, and only that run goes through Pygments again.
+    In languages without such starts, that is the whole file.
+    """
+    new = [s["code_text"] for s in sections]
+    old = [s["code_text"] for s in previous]
+    n, m = len(new), len(old)
+    head = 0
+    while head < min(n, m) and new[head] == old[head]:
+        head += 1
+    tail = 0
+    while tail < min(n, m) - head and new[n - 1 - tail] == old[m - 1 - tail]:
+        tail += 1
+    if head == n == m:
+        return [s["code_html"] for s in previous]
+
+    new_starts = _chunk_starts(sections, language)
+    old_starts = _chunk_starts(previous, language)
+    start = max(i for i in new_starts if i <= head and i in old_starts)
+    ends = [j for j in range(n - tail, n)
+            if j in new_starts and j - n + m in old_starts]
+    end = min(ends) if ends else n
+
+    changed = _highlight_code(sections[start:end], language) if start < end else []
+    before = [s["code_html"] for s in previous[:start]]
+    after = [s["code_html"] for s in previous[end - n + m:]]
+    return before + changed + after
+
+
+# === Highlighting huge files in parallel ===
+#
+# A single huge source, such as generated code or a vendored amalgamation, can
+# take longer than the rest of a build put together. Such a file is cut into
+# chunks of sections, which are highlighted and rendered on a process pool and
+# then stitched back together in order.
+
+# Sources of at least this many characters are split into chunks.
+chunk_threshold = 1024 * 1024
+
+# How many chunks to aim for per process, to even out their sizes.
+chunks_per_job = 4
+
+
+def _chunk_starts(sections, language):
+    """
+    The indices of the sections that a chunk may start at.
+
+    A chunk may only start where the lexer is back in its initial state, so
+    that it is highlighted exactly as it would be as part of the whole file.
+    For Python, we settle for sections whose code opens a top-level `def` or
+    `class`, or a decorator for one, outside of any triple-quoted string so
+    far. Other languages have strings, such as template literals, heredocs
+    and multi-line regexes, that such a line can be inside of, so their
+    sources, like those without such boundaries, only have the start of the
+    file.
+    """
+    starts = set([0])
+    if language["name"] != "python":
+        return starts
+    quotes = 0
     for i, section in enumerate(sections):
-        section["code_html"] = highlight_start + shift(fragments, "") + highlight_end
-        try:
-            docs_text = unicode(section["docs_text"])
-        except UnicodeError:
-            docs_text = unicode(section["docs_text"].decode('utf-8'))
-        except NameError:
-            docs_text = section['docs_text']
-        section["docs_html"] = markdown(
-            preprocess(
-                docs_text,
-                preserve_paths=preserve_paths,
-                outdir=outdir
-            ),
-            extensions=[
-                'markdown.extensions.smarty',
-                'markdown.extensions.fenced_code',
-                'markdown.extensions.footnotes',
-            ]
-        )
-        section["num"] = i
+        code = section["code_text"]
+        if not quotes % 2 and code.startswith(("def ", "class ", "@")):
+            starts.add(i)
+        quotes += code.count('"""') + code.count("'''")
+    return starts
+
+
+def _chunk_sections(sections, count, language):
+    """
+    Split `sections` of code in `language` into about `count` runs of similar
+    code size, each starting at one of the `_chunk_starts`.
+    """
+    target = sum(len(s["code_text"]) for s in sections) // count + 1
+    starts = _chunk_starts(sections, language)
+    chunks = [[]]
+    size = 0
+    for i, section in enumerate(sections):
+        if size >= target and i in starts:
+            chunks.append([])
+            size = 0
+        chunks[-1].append(section)
+        size += len(section["code_text"])
+    return chunks
+
+
+def _highlight_chunk(task):
+    """
+    Highlight a chunk of sections in a worker process, returning the
+    `code_html` and `docs_html` of each, the references and anchors found in
+    the docs, and any profiling events.
 
+    Given the `page` being rendered and its `source`, cross-references are
+    resolved through
+    the link and symbol tables the worker was started with.
+    """
+    sections, language, preserve_paths, outdir, page, source = task
+    links = None
+    if page is not None:
+        links = {"table": _worker_options["links"],
+                 "symbols": _worker_options["symbols"],
+                 "page": page, "source": source,
+                 "refs": [], "anchors": [], "defined": []}
+    highlight(sections, language, preserve_paths=preserve_paths, outdir=outdir,
+              links=links)
+    rendered = [(s["code_html"], s["docs_html"]) for s in sections]
+    if links is not None:
+        return (rendered, links["refs"], links["anchors"]), profiling.take()
+    return (rendered, [], []), profiling.take()
+
+
+def _highlight_in_chunks(sections, language, pool, preserve_paths=True,
+                         outdir=None, links=None):
+    """
+    Like `highlight`, but spread over the processes of `pool`, one chunk of
+    sections at a time. The processes must have been started by
+    `_init_worker` to resolve cross-references through `links`.
+    """
+    chunks = _chunk_sections(sections, pool._processes * chunks_per_job,
+                             language)
+    if len(chunks) < 2:
+        return highlight(sections, language, preserve_paths=preserve_paths,
+                         outdir=outdir, links=links)
+
+    # Workers compile the language and load its lexer for themselves.
+    language = dict((key, value) for key, value in language.items()
+                    if key in ("name", "comment_symbol", "multistart", "multiend"))
+    page = source = None
+    if links is not None:
+        page, source = links["page"], links["source"]
+    results = pool.map(_highlight_chunk, [
+        (chunk, language, preserve_paths, outdir, page, source)
+        for chunk in chunks
+    ], 1)
+
+    rendered = []
+    for (chunk, refs, anchors), events in results:
+        rendered.extend(chunk)
+        if links is not None:
+            links["refs"].extend(refs)
+            links["anchors"].extend(anchors)
+        profiling.merge(events)
+    for i, (section, (code_html, docs_html)) in enumerate(zip(sections, rendered)):
+        section["code_html"] = code_html
+        section["docs_html"] = docs_html
+        section["num"] = i
     return sections
 
+
 # === HTML Code generation ===
 
 
@@ -316,90 +958,194 @@ def generate_html(source, sections, preserve_paths=True, outdir=None):
     Once all of the code is finished highlighting, we can generate the HTML
     file and write out the documentation. Pass the completed sections into the
     template found in `resources/pycco.html`.
-
-    Pystache will attempt to recursively render context variables, so we must
-    replace any occurrences of `{{`, which is valid in some languages, with a
-    "unique enough" identifier before rendering, and then post-process the
-    rendered template and change the identifier back to `{{`.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'outdir' keyword argument")
+    return pycco_template(_page_context(source, sections, preserve_paths,
+                                        outdir)).encode("utf-8")
+
+
+def _page_context(source, sections, preserve_paths, outdir):
+    """
+    The template context for the page of `source`.
+    """
     title = path.basename(source)
     dest = destination(source, preserve_paths=preserve_paths, outdir=outdir)
     csspath = path.relpath(path.join(outdir, "pycco.css"), path.split(dest)[0])
 
-    for sect in sections:
-        sect["code_html"] = re.sub(
-            r"\{\{", r"__DOUBLE_OPEN_STACHE__", sect["code_html"])
-
-    rendered = pycco_template({
+    return {
         "title": title,
         "stylesheet": csspath,
         "sections": sections,
         "source": source,
-    })
-
-    return re.sub(r"__DOUBLE_OPEN_STACHE__", "{{", rendered).encode("utf-8")
+    }
 
 
 # === Helpers & Setup ===
 
 def compile_language(l):
     """
-    Build out the appropriate matchers and delimiters for each language.
+    Build out the appropriate matchers for a language. This
+    happens the first time the language is used, rather than for every
+    language whenever Pycco starts; compiling again is a no-op.
     """
-    language_name = l["name"]
-    comment_symbol = l["comment_symbol"]
+    if "comment_matcher" in l:
+        return l
 
     # Does the line begin with a comment?
-    l["comment_matcher"] = re.compile(r"^\s*{}\s?".format(comment_symbol))
+    l["comment_matcher"] = re.compile(r"^\s*{}\s?".format(l["comment_symbol"]))
+    return l
 
-    # The dividing token we feed into Pygments, to delimit the boundaries between
-    # sections.
-    l["divider_text"] = "\n{}DIVIDER\n".format(comment_symbol)
-
-    # The mirror of `divider_text` that we expect Pygments to return. We can split
-    # on this to recover the original sections.
-    l["divider_html"] = re.compile(
-        r'\n*<span class="c[1]?">{}DIVIDER</span>\n*'.format(comment_symbol)
-    )
-
-    # Get the Pygments Lexer for this language.
-    l["lexer"] = lexers.get_lexer_by_name(language_name)
 
+def get_lexer(language):
+    """
+    Get the Pygments Lexer for a language, loading it on first use.
+    """
+    if "lexer" not in language:
+        from pygments import lexers
+        language["lexer"] = lexers.get_lexer_by_name(language["name"])
+    return language["lexer"]
 
-for entry in supported_languages.values():
-    compile_language(entry)
 
 def get_language(source, code, language_name=None):
     """
-    Get the current language we're documenting, based on the extension.
+    Get the current language we're documenting. A forced language name wins;
+    otherwise we look at the file's extension, then its whole name, then its
+    `#!` line and any Emacs or Vim modeline. Only when all of those fail do we
+    ask Pygments to guess from the start of the code.
     """
     if language_name is not None:
-        for entry in supported_languages.values():
-            if entry["name"] == language_name:
-                return entry
-        else:
+        entry = _languages_by_name().get(language_name)
+        if entry is None:
             raise ValueError("Unknown forced language: {}".format(language_name))
+        return compile_language(entry)
 
-    if source:
-        m = re.match(r'.*(\..+)', os.path.basename(source))
+    filename = os.path.basename(source) if source else ""
+    if filename:
+        m = re.match(r'.*(\..+)', filename)
         if m and m.group(1) in supported_languages:
-            return supported_languages[m.group(1)]
+            return compile_language(supported_languages[m.group(1)])
+        if filename in supported_filenames:
+            return compile_language(supported_filenames[filename])
+
+    code = code or ""
+    entry = _language_from_modelines(code)
+    if entry is not None:
+        return compile_language(entry)
+
+    # Guesses are remembered for the rest of the run, per extension, or per
+    # `#!` line for extension-less scripts.
+    key = None
+    if filename and m:
+        key = m.group(1)
+    elif code.startswith("#!"):
+        key = code.split("\n", 1)[0]
+    if key in _guessed_languages:
+        entry = _guessed_languages[key]
+    else:
+        entry = _guess_language(code)
+        if key is not None:
+            _guessed_languages[key] = entry
+
+    if entry is None:
+        raise ValueError("Can't figure out the language!")
+    return compile_language(entry)
+
+
+# The most code that Pygments is shown when guessing a language. Every lexer
+# gets to analyse the sample, so it is kept small.
+guess_sample_size = 4096
+
+# Languages guessed during this run, reset by `process()`.
+_guessed_languages = {}
+
+_language_index = None
+
+
+def _languages_by_name():
+    """
+    Index every language entry by its name, and by its aliases.
+    """
+    global _language_index
+    if _language_index is None:
+        index = {}
+        for entry in itertools.chain(supported_languages.values(),
+                                     supported_filenames.values()):
+            index.setdefault(entry["name"], entry)
+        for alias, name in language_aliases.items():
+            index.setdefault(alias, index[name])
+        _language_index = index
+    return _language_index
+
+
+def _language_named(name):
+    """
+    Look up a language by a name from a `#!` line or modeline, ignoring case
+    and version numbers, such as in `python3.8` or `tclsh8.6`.
+    """
+    name = name.lower()
+    index = _languages_by_name()
+    return index.get(name) or index.get(re.sub(r"[\d.]+$", "", name))
+
+
+# A `#!` line, capturing the interpreter, or the program that `env` runs.
+shebang_matcher = re.compile(r"#!\s*(?:\S*/)?(?:env\s+(?:-\S+\s+)*)?([^\s/]+)")
+
+# `-*- mode: python -*-` or `-*- python -*-`
+emacs_modeline_matcher = re.compile(r"-\*-\s*(?:.*?\bmode:\s*)?([\w+#-]+)[\s;]*(?:.*?)-\*-", re.I)
+
+# `vim: set ft=python:`, `vi: filetype=python`, and so on.
+vim_modeline_matcher = re.compile(r"\b(?:vim?|ex):.*?\b(?:ft|filetype|syntax)=([\w+#-]+)")
 
+
+def _language_from_modelines(code):
+    """
+    Find a language named by the `#!` line or an editor modeline of `code`.
+    Emacs reads modelines from the first two lines, and Vim from the first
+    and last five.
+    """
+    head = code[:1024].split("\n", 5)[:5]
+    if head and head[0].startswith("#!"):
+        m = shebang_matcher.match(head[0])
+        entry = m and _language_named(m.group(1))
+        if entry:
+            return entry
+
+    for line in head[:2]:
+        m = emacs_modeline_matcher.search(line)
+        entry = m and _language_named(m.group(1))
+        if entry:
+            return entry
+
+    for line in head + code[-1024:].split("\n")[-5:]:
+        m = vim_modeline_matcher.search(line)
+        entry = m and _language_named(m.group(1))
+        if entry:
+            return entry
+
+    return None
+
+
+def _guess_language(code):
+    """
+    Ask Pygments to guess the language of `code` from a bounded sample of it,
+    returning `None` when it has no idea or guesses a language we don't
+    support.
+    """
+    from pygments import lexers
     try:
-        language_name = lexers.guess_lexer(code).name.lower()
-        for entry in supported_languages.values():
-            if entry["name"] == language_name:
-                return entry
-        else:
-            raise ValueError()
+        lexer = lexers.guess_lexer(code[:guess_sample_size])
     except ValueError:
         # If pygments can't find any lexers, it will raise its own
-        # subclass of ValueError. We will catch it and raise ours
-        # for consistency.
-        raise ValueError("Can't figure out the language!")
+        # subclass of ValueError.
+        return None
+
+    index = _languages_by_name()
+    for name in [lexer.name.lower()] + list(getattr(lexer, "aliases", [])):
+        if name in index:
+            return index[name]
+    return None
 
 
 def destination(filepath, preserve_paths=True, outdir=None):
@@ -465,84 +1211,676 @@ highlight_start = "<div class=\"highlight\"><pre>"
 highlight_end = "</pre></div>"
 
 
-def _flatten_sources(sources):
+# Directories that never hold sources worth documenting, and are skipped
+# whenever a directory is walked.
+default_excludes = [".git", ".hg", ".svn", ".bzr", "__pycache__", "node_modules"]
+
+
+def _flatten_sources(sources, include=None, exclude=None):
     """
     This function will iterate through the list of sources and if a directory
     is encountered it will walk the tree for any files.
     """
-    _sources = []
+    return list(_iter_sources(sources, include=include, exclude=exclude))
+
+
+def _iter_sources(sources, include=None, exclude=None):
+    """
+    Lazily yield the source files named by `sources`, walking any directory
+    among them. Files and directories matching one of the `exclude` glob
+    patterns, by name or by path relative to the directory given, are
+    skipped, and excluded directories are never listed. When `include`
+    patterns are given, only the files matching one of them are yielded from
+    directories. Files named explicitly are always yielded.
+
+    Directories are walked with an explicit stack rather than recursion, and
+    listed in sorted order with subdirectories sorted as if their names ended
+    in a path separator. Files come out in the same order that sorting all of
+    their paths would give, without holding them all in memory.
+    """
+    exclude = default_excludes + list(exclude or [])
+
+    for source in sorted(sources, key=_sort_key):
+        if not os.path.isdir(source):
+            yield source
+            continue
+
+        stack = [_list_directory(source, "")]
+        while stack:
+            for name, full_path, relpath, is_dir in stack[-1]:
+                if _matches(exclude, name, relpath):
+                    continue
+                if is_dir:
+                    stack.append(_list_directory(full_path, relpath))
+                    break
+                if include and not _matches(include, name, relpath):
+                    continue
+                yield full_path
+            else:
+                stack.pop()
+
+
+def _sort_key(filepath):
+    return filepath + os.sep if os.path.isdir(filepath) else filepath
+
+
+def _list_directory(directory, relative):
+    """
+    Return an iterator over the sorted entries of `directory`, as tuples of
+    name, path, path relative to the walked tree, and whether it is a
+    directory to descend into. Like `os.walk`, unreadable directories are
+    treated as empty, and symbolic links to directories are not followed.
+    """
+    entries = []
+    try:
+        for entry in pycco_scandir(directory):
+            relpath = relative + "/" + entry.name if relative else entry.name
+            is_dir = entry.is_dir() and not entry.is_symlink()
+            entries.append((entry.name, entry.path, relpath, is_dir))
+    except OSError:
+        pass
+
+    entries.sort(key=lambda e: e[0] + os.sep if e[3] else e[0])
+    return iter(entries)
+
+
+def _matches(patterns, name, relpath):
+    return any(fnmatch(name, pattern) or fnmatch(relpath, pattern)
+               for pattern in patterns)
+
+
+# The build options of a `--jobs` worker process, set by `_init_worker()`.
+_worker_options = None
+
+
+def _init_worker(options):
+    """
+    Store the build options in a worker process of the `--jobs` pool, so that
+    each task only has to carry the path of its source file. Worker processes
+    live for the whole build, which keeps their compiled languages, lexers and
+    Markdown state warm from one file to the next.
+    """
+    global _worker_options
+    _worker_options = options
+    if options.get("profile"):
+        profiling.start(memory=options["profile_memory"])
+
+
+def _document_source(task, options=None, pool=None):
+    """
+    Generate and write the documentation for a single source file, returning a
+    result dictionary that `process()` can report on. Errors for bad files are
+    handed back to the caller instead of raised, so that `--skip-bad-files`
+    can be honoured no matter which process did the work.
+
+    A `task` is a source path and its entry from the build manifest, if any.
+    When the source and its options still match that entry, the existing
+    documentation is left alone.
+
+    Huge sources are split across the processes of `pool`. A worker process
+    has no pool of its own, so it hands a huge source back to `process()` as
+    deferred, to be documented with the help of all the workers.
+
+    When profiling, the events recorded for the file go back with the result.
+    """
+    with profiling.source(task[0]):
+        result = _render_source(task, options or _worker_options, pool)
+    result["profile"] = profiling.take()
+    return result
+
+
+def _render_source(task, options, pool):
+    """
+    Do the work of `_document_source`, phase by phase.
+    """
+    source, entry = task
+    preserve_paths, outdir = options["preserve_paths"], options["outdir"]
+    dest = destination(source, preserve_paths=preserve_paths, outdir=outdir)
+    result = {"source": source, "dest": dest, "error": None,
+              "hash": None, "unchanged": False, "deferred": None,
+              "links": None}
+
+    try:
+        with profiling.phase("read"):
+            with open(source, "rb") as f:
+                data = f.read()
+            result["hash"] = source_hash(data)
+        if is_current(entry, result["hash"], _manifest_options(options), dest):
+            result["unchanged"] = True
+            return result
+        if options.get("defer_huge") and len(data) >= chunk_threshold:
+            result["deferred"] = task
+            return result
+
+        code = data.decode(options["encoding"])
+        cache = None
+        if options["cache_dir"]:
+            cache = SectionCache(options["cache_dir"], options["cache_size"])
+        links = None
+        if options.get("links") is not None:
+            links = {"table": options["links"], "symbols": options["symbols"],
+                     "page": dest, "source": source,
+                     "refs": [], "anchors": [], "defined": []}
+        sections = _document_sections(source, code, outdir, preserve_paths,
+                                      options["language"], cache=cache,
+                                      pool=pool, kept=options.get("kept"),
+                                      links=links)
+        if links is not None:
+            result["links"] = {"refs": links["refs"],
+                               "anchors": sorted(set(links["anchors"])),
+                               "symbols": qualify_symbols(links["defined"])}
+    except (ValueError, UnicodeDecodeError) as e:
+        result["error"] = e
+        return result
+
+    # The page is normally streamed straight into the file as it is
+    # rendered; when profiling, it is rendered first so that templating and
+    # writing can be timed apart.
+    chunks = pycco_template.render_iter(
+        _page_context(source, sections, preserve_paths, outdir))
+    if profiling.recording() or options.get("minify"):
+        with profiling.phase("template"):
+            chunks = list(chunks)
+    if options.get("minify"):
+        with profiling.phase("minify"):
+            chunks = [minify_html(u"".join(chunks))]
+
+    with profiling.phase("write"):
+        write_file(dest, (chunk.encode("utf-8") for chunk in chunks))
+
+    return result
+
+
+def _manifest_options(options):
+    """
+    The subset of the build options that affects the documentation of a
+    single file, as recorded in the build manifest.
+    """
+    return {
+        "preserve_paths": options["preserve_paths"],
+        "language": options["language"],
+        "encoding": options["encoding"],
+        "minify": options.get("minify", False),
+        "version": __version__,
+    }
 
-    for source in sources:
-        if os.path.isdir(source):
-            for dirpath, _, filenames in os.walk(source):
-                _sources.extend([os.path.join(dirpath, f) for f in filenames])
-        else:
-            _sources.append(source)
 
-    return _sources
+# How many files each worker is sent at a time.
+_pool_chunksize = 4
+
+
+def _document_sources(tasks, options, jobs=1):
+    """
+    Yield the result of documenting each task, in the order of `tasks`.
+    With more than one job the files are spread over a pool of worker
+    processes; `imap` hands the results back in their original order. Huge
+    files come back deferred, and are then documented here in chunks spread
+    over the same pool.
+    """
+    if jobs == 1:
+        for task in tasks:
+            yield _document_source(task, options)
+        return
+
+    import multiprocessing
+    pool = multiprocessing.Pool(jobs, initializer=_init_worker,
+                                initargs=(dict(options, defer_huge=True),))
+    try:
+        for result in pool.imap(_document_source, tasks, _pool_chunksize):
+            if result["deferred"]:
+                result = _document_source(result["deferred"], options, pool=pool)
+            yield result
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 def process(sources, preserve_paths=True, outdir=None, language=None,
-            encoding="utf8", index=False, skip=False):
+            encoding="utf8", index=False, skip=False, jobs=1, force=False,
+            cache_dir=None, cache_size=DEFAULT_MAX_SIZE, include=None,
+            exclude=None, profile=None, profile_memory=False, kept=None,
+            sharded_index=False, check_links=False, minify=False,
+            compress=False):
     """
     For each source file passed as argument, generate the documentation.
+
+    Set `jobs` to spread the work over that many processes, or to `0` (or
+    less) to use one process per CPU. Sources that have not changed since the
+    last run, according to the build manifest in `outdir`, are skipped unless
+    `force` is set. Set `cache_dir` to reuse rendered sections across files
+    and builds, through a `SectionCache` of at most `cache_size` bytes.
+    Directories are walked for files matching the `include` glob patterns, if
+    any, skipping those matching the `exclude` patterns.
+
+    Set `profile` to a file name to record how long each phase of each file
+    takes, and the peak memory allocated too with `profile_memory`. The
+    results are written there as a Chrome trace, and summed up on stdout.
+
+    With `index` set, an `index.html` lists everything documented in `outdir`;
+    with `sharded_index` too, every directory gets an `_index.html` of its own
+    instead of one page for the whole tree.
+
+    When building in a single process, a dictionary passed as `kept` keeps
+    the rendered sections of each file for the next call, which then only
+    renders the sections that have changed.
+
+    With `check_links` set, cross-references anywhere in `outdir` to files or
+    sections that do not exist are reported, and returned as a list of
+    `(source, reference, problem)` tuples.
+
+    Set `minify` to compact the HTML and CSS written, and `compress` to write
+    gzip (and brotli, when it is installed) compressed copies of them, for
+    web servers to send as they are. Pages are compressed on a pool of
+    threads while the build goes on.
     """
 
     if not outdir:
         raise TypeError("Missing the required 'directory' keyword argument.")
 
-    # Make a copy of sources given on the command line. `main()` needs the
-    # original list when monitoring for changed files.
-    sources = sorted(_flatten_sources(sources))
+    # All the sources are discovered up front, for the link table. `main()`
+    # needs the original list when monitoring for changed files.
+    sources = list(_iter_sources(sources, include=include, exclude=exclude))
 
-    # Proceed to generating the documentation.
-    if sources:
-        outdir = ensure_directory(outdir)
-        css = open(path.join(outdir, "pycco.css"), "wb")
-        css.write(pycco_css.encode(encoding))
-        css.close()
+    _guessed_languages.clear()
 
-        generated_files = []
+    if jobs is None or jobs < 1:
+        import multiprocessing
+        jobs = multiprocessing.cpu_count()
 
-        def next_file():
-            s = sources.pop(0)
-            dest = destination(s, preserve_paths=preserve_paths, outdir=outdir)
+    # Proceed to generating the documentation.
+    broken = []
+    if sources:
+        with _compressing(jobs if compress else 0) as compress_later:
+            outdir = ensure_directory(outdir)
+            css = minify_css(pycco_css) if minify else pycco_css
+            write_file(path.join(outdir, "pycco.css"), css.encode(encoding))
+            compress_later(path.join(outdir, "pycco.css"))
+
+            options = {
+                "preserve_paths": preserve_paths,
+                "outdir": outdir,
+                "language": language,
+                "encoding": encoding,
+                "cache_dir": cache_dir,
+                "cache_size": cache_size,
+                "profile": bool(profile),
+                "profile_memory": profile_memory,
+                "kept": kept if jobs == 1 else None,
+                "minify": minify,
+            }
+            manifest = load_manifest(outdir)
+            entries = manifest["files"]
+            options["links"] = build_link_table(sources, preserve_paths,
+                                                outdir, manifest)
+            options["symbols"] = symbols = build_symbol_table(entries)
+            tasks = ((s, None if force else entries.get(manifest_key(s)))
+                     for s in sources)
+            # Sources that are gone are dropped from the manifest, and so
+            # from the index.
+            updated, removed = {}, set(s for s in entries if not path.isfile(s))
+            events = []
+            if profile:
+                profiling.start(memory=profile_memory)
+
+            def record(result):
+                events.extend(result["profile"] or ())
+                s, dest, e = result["source"], result["dest"], result["error"]
+                if e is not None:
+                    removed.add(s)
+                    if skip:
+                        print("pycco [FAILURE]: {}, {}".format(s, e))
+                        return
+                    raise e
+
+                if result["unchanged"]:
+                    print("pycco: {} -> {} (unchanged)".format(s, dest))
+                else:
+                    print("pycco: {} -> {}".format(s, dest))
+                if result["unchanged"]:
+                    links = entries[manifest_key(s)]
+                else:
+                    links = result["links"]
+                updated[s] = {
+                    "hash": result["hash"],
+                    "options": _manifest_options(options),
+                    "dest": path.normpath(dest),
+                    "refs": links.get("refs", []),
+                    "anchors": links.get("anchors", []),
+                    "symbols": links.get("symbols", []),
+                }
+                # Files documented later on in this process can link to the
+                # symbols of this one straight away.
+                symbols.update(build_symbol_table({s: updated[s]}))
+                # Pages that may yet be rendered again are compressed last.
+                if not _has_unresolved(updated[s]):
+                    compress_later(dest)
 
             try:
-                os.makedirs(path.split(dest)[0])
-            except OSError:
-                pass
+                for result in _document_sources(tasks, options, jobs=jobs):
+                    record(result)
+
+                # References to symbols of files that were documented later,
+                # or by another worker, could not be resolved the first time
+                # round, and unchanged pages may refer to files that have
+                # been added, or to symbols that have moved, since. Only the
+                # pages with such references are rendered once more.
+                gone = set(manifest_key(s) for s in removed)
+                entries = dict((s, entry) for s, entry in entries.items()
+                               if s not in gone)
+                entries.update((manifest_key(s), updated[s]) for s in updated)
+                symbols.clear()
+                symbols.update(build_symbol_table(entries))
+                late = [s for s in sorted(updated) if _is_stale(
+                    updated[s], s, options["links"], symbols)]
+                for result in _document_sources(((s, None) for s in late), options):
+                    record(result)
+                for s in sorted(updated):
+                    if _has_unresolved(updated[s]):
+                        compress_later(updated[s]["dest"])
+            finally:
+                manifest = update_manifest(outdir, updated, removed)
+                if cache_dir:
+                    SectionCache(cache_dir, cache_size).prune()
+                if profile:
+                    events.extend(profiling.stop())
+                    profiling.write_trace(profile, events)
+                    for line in profiling.summary(events):
+                        print(line)
+
+            _write_symbols(outdir, build_symbol_table(manifest["files"]))
+            if index:
+                for filename in _write_index(outdir, manifest,
+                                             sharded=sharded_index,
+                                             minify=minify):
+                    compress_later(filename)
+
+            if check_links:
+                broken = find_broken_links(manifest)
+                for source, reference, problem in broken:
+                    print("pycco [BROKEN LINK]: {}: [[{}]], {}".format(
+                        source, reference, problem))
+
+    return broken
+
+
+def _has_unresolved(entry):
+    return any(dest is None for _, _, dest in entry["refs"])
+
+
+def _write_index(outdir, manifest, sharded=False, minify=False):
+    """
+    Write the index of everything documented in `outdir`, as listed by its
+    build manifest, so that even a partial build gets a complete index. Index
+    pages that have not changed are left alone. Returns the names of the
+    index pages.
+    """
+    dests = sorted(entry["dest"] for entry in manifest["files"].values())
+    if sharded:
+        pages = list(generate_index_pages(dests, outdir))
+    else:
+        pages = [(path.join(outdir, "index.html"), generate_index(dests, outdir))]
+    for filename, html in pages:
+        if minify:
+            html = minify_html(html.decode("utf-8")).encode("utf-8")
+        write_file(filename, html)
+    return [filename for filename, _ in pages]
 
-            try:
-                with open(dest, "wb") as f:
-                    f.write(generate_documentation(s, preserve_paths=preserve_paths,
-                                                   outdir=outdir,
-                                                   language=language,
-                                                   encoding=encoding))
-
-                print("pycco: {} -> {}".format(s, dest))
-                generated_files.append(dest)
-            except (ValueError, UnicodeDecodeError) as e:
-                if skip:
-                    print("pycco [FAILURE]: {}, {}".format(s, e))
-                else:
-                    raise
 
-            if sources:
-                next_file()
-        next_file()
+@contextlib.contextmanager
+def _compressing(jobs):
+    """
+    A context giving a function that compresses a file in the background, on
+    a pool of `jobs` threads; with no jobs, the function does nothing. Leaving
+    the context waits for every file to be compressed.
+    """
+    if not jobs:
+        yield lambda filename: None
+        return
 
-        if index:
-            with open(path.join(outdir, "index.html"), "wb") as f:
-                f.write(generate_index(generated_files, outdir))
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(jobs)
+    pending = []
+    try:
+        yield lambda filename: pending.append(
+            pool.apply_async(compress_file, (filename,)))
+        pool.close()
+        for job in pending:
+            job.get()
+    finally:
+        pool.terminate()
+        pool.join()
 
 
 __all__ = ("process", "generate_documentation")
 
 
-def monitor(sources, opts):
+# === Watching for changes ===
+#
+# In watch mode, file system events are not acted on as they come in. Editors
+# tend to fire several events for a single save, so changed sources are only
+# collected until things have been quiet for `debounce_delay` seconds, and then
+# regenerated in one batch on a single long-lived worker thread. That thread
+# keeps its Markdown and Pygments state warm from one batch to the next, and
+# the watchdog thread is never held up by a build. The rendered sections of
+# every file are kept too, so that an edit only re-renders the sections it
+# touched.
+
+# Seconds to wait after a change for more changes, before regenerating.
+debounce_delay = 0.2
+
+
+class _Regenerator(object):
+    """
+    Collect the sources touched by file system events, and regenerate their
+    documentation in debounced batches. Sources that no longer exist by the
+    time their batch comes up have their documentation removed instead.
+
+    `sources` are the files and directories given on the command line, and
+    `options` the keyword arguments to pass on to `process()`. `kept` is the
+    dictionary of rendered sections, as for `process()`, that the first
+    build filled in, if any.
+    """
+
+    def __init__(self, sources, options, delay=debounce_delay, kept=None):
+        self.sources = sources
+        self.options = options
+        self.delay = delay
+        self.files = dict((path.abspath(s), s) for s in sources
+                          if not path.isdir(s))
+        self.directories = [(path.abspath(s), s) for s in sources
+                            if path.isdir(s)]
+        self.exclude = default_excludes + list(options.get("exclude") or [])
+        self.kept = {} if kept is None else kept
+        self.cold = []
+        self.pending = set()
+        self.deadline = None
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+
+    def source_for(self, filepath):
+        """
+        The source path a build would use for the file at `filepath`, or
+        `None` if the file is not one of the sources being watched.
+        """
+        filepath = path.abspath(filepath)
+        if filepath in self.files:
+            return self.files[filepath]
+
+        include = self.options.get("include")
+        for directory, source in self.directories:
+            relpath = path.relpath(filepath, directory)
+            if relpath.startswith(os.pardir):
+                continue
+            steps = relpath.split(os.sep)
+            for i in range(len(steps)):
+                if _matches(self.exclude, steps[i], "/".join(steps[:i + 1])):
+                    return None
+            if include and not _matches(include, steps[-1], "/".join(steps)):
+                return None
+            return path.join(source, relpath)
+        return None
+
+    def changed(self, filepath, is_directory=False):
+        """
+        Note that the file at `filepath` was created, modified or deleted, or
+        the directory along with everything in it.
+        """
+        if is_directory:
+            # The files that were in the directory are only known to the
+            # manifest, and those in it now have to be listed.
+            prefix = path.abspath(filepath) + os.sep
+            for source in load_manifest(self.options["outdir"])["files"]:
+                if path.abspath(source).startswith(prefix):
+                    self.changed(source)
+            if path.isdir(filepath):
+                for source in _iter_sources([filepath]):
+                    self.changed(source)
+            return
+
+        source = self.source_for(filepath)
+        if source is None:
+            return
+        with self.condition:
+            self.pending.add(source)
+            self.deadline = time.time() + self.delay
+            self.condition.notify()
+
+    def warm(self):
+        """
+        Render the sections of the sources that are not kept yet, one at a
+        time whenever there is nothing to regenerate, so that the first change
+        to each of them only renders again what changed. Files the first
+        build left alone as unchanged are only kept this way.
+        """
+        cold = _iter_sources(self.sources, include=self.options.get("include"),
+                             exclude=self.options.get("exclude"))
+        with self.condition:
+            self.cold = [s for s in cold if s not in self.kept][::-1]
+            self.condition.notify()
+
+    def _warm_next(self):
+        with self.condition:
+            if not self.cold:
+                return
+            source = self.cold.pop()
+        if source in self.kept:
+            return
+
+        options = self.options
+        cache = None
+        if options.get("cache_dir"):
+            cache = SectionCache(options["cache_dir"],
+                                 options.get("cache_size", DEFAULT_MAX_SIZE))
+        try:
+            with open(source, "rb") as f:
+                code = f.read().decode(options.get("encoding", "utf8"))
+            _document_sections(source, code, options["outdir"],
+                               options.get("preserve_paths", True),
+                               options.get("language"), cache=cache,
+                               kept=self.kept)
+        except (ValueError, UnicodeDecodeError, IOError, OSError):
+            # The file is rendered in full when it changes, as it would
+            # have been anyway.
+            pass
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and (
+                        not self.pending or time.time() < self.deadline):
+                    if not self.pending and self.cold:
+                        break
+                    timeout = None
+                    if self.pending:
+                        timeout = self.deadline - time.time()
+                    self.condition.wait(timeout)
+                if self.stopped:
+                    return
+                ready = bool(self.pending)
+            if ready:
+                self.flush()
+            else:
+                self._warm_next()
+
+    def flush(self):
+        """
+        Regenerate the documentation for the pending sources right away.
+        """
+        with self.condition:
+            batch, self.pending = self.pending, set()
+        if not batch:
+            return
+
+        options = dict(self.options, kept=self.kept)
+        outdir = options["outdir"]
+        index = options.pop("index", False)
+        options.pop("include", None)
+        options.pop("exclude", None)
+
+        deleted = sorted(s for s in batch if not path.isfile(s))
+        changed = sorted(s for s in batch if path.isfile(s))
+        try:
+            if deleted:
+                _remove_documentation(deleted, outdir,
+                                      options.get("preserve_paths", True))
+                for source in deleted:
+                    self.kept.pop(source, None)
+            if changed:
+                process(changed, **options)
+            if index:
+                pages = _write_index(outdir, load_manifest(outdir),
+                                     sharded=options.get("sharded_index", False),
+                                     minify=options.get("minify", False))
+                if options.get("compress"):
+                    for filename in pages:
+                        compress_file(filename)
+        except (ValueError, UnicodeDecodeError, IOError, OSError) as e:
+            print("pycco [FAILURE]: {}".format(e))
+
+
+def _remove_documentation(sources, outdir, preserve_paths=True):
+    """
+    Remove the documentation of `sources`, and their entries in the build
+    manifest.
+    """
+    entries = load_manifest(outdir)["files"]
+    for source in sources:
+        entry = entries.get(manifest_key(source))
+        if entry is not None:
+            dest = entry["dest"]
+        else:
+            dest = destination(source, preserve_paths=preserve_paths,
+                               outdir=outdir)
+        try:
+            os.remove(dest)
+        except OSError:
+            continue
+        for suffix in COMPRESSED_SUFFIXES:
+            try:
+                os.remove(dest + suffix)
+            except OSError:
+                pass
+        print("pycco: {} -> (removed) {}".format(source, dest))
+    update_manifest(outdir, removed=sources)
+
+
+def monitor(sources, opts, kept=None):
     """
-    Monitor each source file and re-generate documentation on change.
+    Monitor each source file, and each directory given as a source
+    recursively, and re-generate documentation on change. `kept` holds the
+    sections rendered by the first build, if it kept them.
     """
 
     # The watchdog modules are imported in `main()` but we need to re-import
@@ -550,37 +1888,52 @@ def monitor(sources, opts):
     import watchdog.events
     import watchdog.observers
 
-    # Watchdog operates on absolute paths, so map those to original paths
-    # as specified on the command line.
-    absolute_sources = dict((os.path.abspath(source), source)
-                            for source in sources)
+    regenerator = _Regenerator(sources, {
+        "outdir": opts.outdir or ".",
+        "preserve_paths": opts.paths,
+        "language": opts.language,
+        "index": opts.generate_index or opts.sharded_index,
+        "sharded_index": opts.sharded_index,
+        "skip": opts.skip_bad_files,
+        "cache_dir": opts.cache_dir,
+        "cache_size": opts.cache_size * 1024 * 1024,
+        "include": opts.include,
+        "exclude": opts.exclude,
+        "minify": opts.minify,
+        "compress": opts.compress,
+    }, kept=kept)
+    regenerator.warm()
 
     class RegenerateHandler(watchdog.events.FileSystemEventHandler):
         """
-        A handler for recompiling files which triggered watchdog events.
+        A handler queueing the files which triggered watchdog events.
         """
 
-        def on_modified(self, event):
-            """
-            Regenerate documentation for a file which triggered an event.
-            """
-            # Re-generate documentation from a source file if it was listed on
-            # the command line. Watchdog monitors whole directories, so other
-            # files may cause notifications as well.
-            if event.src_path in absolute_sources:
-                process([absolute_sources[event.src_path]],
-                        outdir=opts.outdir,
-                        preserve_paths=opts.paths)
-
-    # Set up an observer which monitors all directories for files given on
-    # the command line and notifies the handler defined above.
+        def on_created(self, event):
+            if not event.is_directory:
+                regenerator.changed(event.src_path)
+
+        on_modified = on_created
+
+        def on_deleted(self, event):
+            regenerator.changed(event.src_path, event.is_directory)
+
+        def on_moved(self, event):
+            regenerator.changed(event.src_path, event.is_directory)
+            regenerator.changed(event.dest_path, event.is_directory)
+
+    # Set up an observer which monitors the directories given on the command
+    # line recursively, and the directories of the files given on it, and
+    # notifies the handler defined above.
     event_handler = RegenerateHandler()
     observer = watchdog.observers.Observer()
-    directories = set(os.path.split(source)[0] for source in sources)
-    for directory in directories:
+    for directory, _ in regenerator.directories:
+        observer.schedule(event_handler, path=directory, recursive=True)
+    for directory in set(path.dirname(f) for f in regenerator.files):
         observer.schedule(event_handler, path=directory)
 
     # Run the file change monitoring loop until the user hits Ctrl-C.
+    regenerator.start()
     observer.start()
     try:
         while True:
@@ -588,6 +1941,54 @@ def monitor(sources, opts):
     except KeyboardInterrupt:
         observer.stop()
         observer.join()
+        regenerator.stop()
+
+
+def serve_main(argv):
+    """
+    The `pycco serve` command, rendering pages as they are browsed.
+    """
+
+    parser = argparse.ArgumentParser(prog='pycco serve')
+    parser.add_argument('-p', '--paths', action='store_true',
+                      help='Preserve path structure of original files')
+
+    parser.add_argument('-l', '--force-language', action='store', type=str,
+                      dest='language', default=None,
+                      help='Force the language for the given files')
+
+    parser.add_argument('-b', '--bind', action='store', type=str,
+                      default='127.0.0.1',
+                      help='The address to listen on')
+
+    parser.add_argument('--port', action='store', type=int, default=8000,
+                      help='The port to listen on')
+
+    parser.add_argument('-t', '--threads', action='store', type=int, default=4,
+                      help='Number of threads to handle requests with')
+
+    parser.add_argument('--cache-size', action='store', type=int, default=64,
+                      help='The size limit of the cache of rendered pages, in megabytes')
+
+    parser.add_argument('--rescan-interval', action='store', type=float, default=2.0,
+                      help='The least number of seconds between two looks for new sources')
+
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                      help='Only serve files in directories that match this glob pattern; may be repeated')
+
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                      help='Skip files and directories that match this glob pattern; may be repeated')
+
+    parser.add_argument('sources', nargs='+')
+
+    args = parser.parse_args(argv)
+
+    from pycco.server import serve
+    serve(args.sources, host=args.bind, port=args.port, threads=args.threads,
+          preserve_paths=args.paths, language=args.language,
+          include=args.include, exclude=args.exclude,
+          cache_size=args.cache_size * 1024 * 1024,
+          rescan_interval=args.rescan_interval)
 
 
 def main():
@@ -595,6 +1996,9 @@ def main():
     Hook spot for the console script.
     """
 
+    if sys.argv[1:2] == ['serve']:
+        return serve_main(sys.argv[2:])
+
     parser = argparse.ArgumentParser()
     parser.add_argument('-p', '--paths', action='store_true',
                       help='Preserve path structure of original files')
@@ -613,11 +2017,49 @@ def main():
     parser.add_argument('-i', '--generate_index', action='store_true',
                       help='Generate an index.html document with sitemap content')
 
+    parser.add_argument('--sharded-index', action='store_true',
+                      help='Generate an _index.html document in every directory instead of one index.html for the whole tree')
+
     parser.add_argument('-s', '--skip-bad-files', '-e', '--ignore-errors',
                       action='store_true',
                       dest='skip_bad_files',
                       help='Continue processing after hitting a bad file')
 
+    parser.add_argument('-j', '--jobs', action='store', type=int, default=1,
+                      help='Number of processes to generate documentation with; '
+                           '0 uses one per CPU')
+
+    parser.add_argument('-f', '--force', action='store_true',
+                      help='Regenerate documentation even for sources that have not changed')
+
+    parser.add_argument('--cache-dir', action='store', type=str, default=None,
+                      help='Cache rendered sections in this directory, across files and builds')
+
+    parser.add_argument('--cache-size', action='store', type=int,
+                      default=DEFAULT_MAX_SIZE // (1024 * 1024),
+                      help='The size limit of the section cache, in megabytes')
+
+    parser.add_argument('--include', action='append', metavar='PATTERN',
+                      help='Only document files in directories that match this glob pattern; may be repeated')
+
+    parser.add_argument('--exclude', action='append', metavar='PATTERN',
+                      help='Skip files and directories that match this glob pattern; may be repeated')
+
+    parser.add_argument('--profile', action='store', type=str, metavar='FILE',
+                      help='Record the time each phase of each file takes, as a Chrome trace in FILE')
+
+    parser.add_argument('--profile-memory', action='store_true',
+                      help='With --profile, also record the peak memory of each phase')
+
+    parser.add_argument('--check-links', action='store_true',
+                      help='Report cross-references to files or sections that do not exist')
+
+    parser.add_argument('--minify', action='store_true',
+                      help='Compact the generated HTML and CSS')
+
+    parser.add_argument('--compress', action='store_true',
+                      help='Also write gzip (and brotli, if installed) compressed copies of the output, for static serving')
+
     parser.add_argument('sources', nargs='*')
 
     args = parser.parse_args()
@@ -626,9 +2068,19 @@ def main():
     else:
         outdir = args.outdir
 
-    process(args.sources, outdir=outdir, preserve_paths=args.paths,
-            language=args.language, index=args.generate_index,
-            skip=args.skip_bad_files)
+    # In watch mode, the first build keeps the sections it renders, so that
+    # the first change to each file only renders again what changed.
+    kept = {} if args.watch else None
+    broken = process(args.sources, outdir=outdir, preserve_paths=args.paths,
+                     language=args.language,
+                     index=args.generate_index or args.sharded_index,
+                     sharded_index=args.sharded_index,
+                     skip=args.skip_bad_files, jobs=args.jobs, force=args.force,
+                     cache_dir=args.cache_dir, cache_size=args.cache_size * 1024 * 1024,
+                     include=args.include, exclude=args.exclude,
+                     profile=args.profile, profile_memory=args.profile_memory,
+                     check_links=args.check_links, minify=args.minify,
+                     compress=args.compress, kept=kept)
 
     # If the -w / \-\-watch option was present, monitor the source directories
     # for changes and re-generate documentation for source files whenever they
@@ -640,7 +2092,10 @@ def main():
         except ImportError:
             sys.exit('The -w/--watch option requires the watchdog package.')
 
-        monitor(args.sources, args)
+        monitor(args.sources, args, kept=kept)
+
+    if broken:
+        sys.exit(1)
 
 
 # Run the script.
@@ -0,0 +1,175 @@
+"""
+Pycco keeps a small build manifest in the output directory. For every source
+it has documented, the manifest records a hash of the source, the options
+that affect its output, and the path the documentation was written to. On the
+next run, sources whose entries still match are not read, parsed or rendered
+again.
+
+The manifest is also the listing of everything documented in the output
+directory, which the index is generated from. Builds fold their changes into
+the manifest with `update_manifest()`, under a lock file, so that partial,
+watch-mode and concurrent builds into the same directory all keep it whole.
+
+Paths are stored relative to the output directory, so that builds run from
+other working directories find the same sources. A loaded manifest has them
+the way a build names them: sources by their `manifest_key()`, and pages
+joined onto the output directory, normalised.
+"""
+import errno
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from os import path
+
+from pycco.output import write_file
+
+__all__ = ('load_manifest', 'save_manifest', 'update_manifest', 'manifest_key',
+           'source_hash', 'is_current')
+
+# The name of the manifest file, inside the output directory.
+MANIFEST_NAME = '.pycco-manifest.json'
+
+# Bump this whenever the layout of the manifest changes, so that manifests
+# written by other versions of this module are ignored instead of misread.
+MANIFEST_FORMAT = 2
+
+# The lock file guarding updates to the manifest, and the age in seconds after
+# which a lock is taken to have been left behind by a build that crashed.
+LOCK_NAME = '.pycco-manifest.lock'
+LOCK_TIMEOUT = 60
+
+
+def load_manifest(outdir):
+    """
+    Read the manifest from `outdir`. A missing, unreadable or outdated
+    manifest gives an empty one, which simply means everything is rebuilt.
+    """
+    try:
+        with open(path.join(outdir, MANIFEST_NAME), 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+    except (IOError, OSError, ValueError):
+        manifest = None
+
+    if not isinstance(manifest, dict) or manifest.get('format') != MANIFEST_FORMAT:
+        return {'format': MANIFEST_FORMAT, 'files': {}}
+    files = {}
+    for name, entry in manifest['files'].items():
+        files[manifest_key(path.join(outdir, name))] = _convert_pages(
+            entry, lambda page: path.normpath(path.join(outdir, page)))
+    manifest['files'] = files
+    return manifest
+
+
+def save_manifest(outdir, manifest):
+    """
+    Write the manifest back to `outdir`. It is written like any other output,
+    so readers never see half a manifest.
+    """
+    top = path.abspath(outdir)
+    files = {}
+    for source, entry in manifest['files'].items():
+        files[_relative(path.abspath(source), top)] = _convert_pages(
+            entry, lambda page: _relative(page, outdir))
+    manifest = dict(manifest, files=files)
+    data = json.dumps(manifest, sort_keys=True, separators=(',', ':'))
+    write_file(path.join(outdir, MANIFEST_NAME), data.encode('utf-8'))
+
+
+def update_manifest(outdir, updated=None, removed=()):
+    """
+    Fold the entries of a build into the manifest in `outdir`, returning the
+    result. `updated` maps sources to their new entries, and the sources in
+    `removed` are dropped, as are entries whose documentation no longer
+    exists. Other builds' changes since the manifest was loaded are kept,
+    since it is read again under the lock.
+    """
+    with _locked(outdir):
+        manifest = load_manifest(outdir)
+        files = manifest['files']
+        for source, entry in (updated or {}).items():
+            files[manifest_key(source)] = entry
+        for source in removed:
+            files.pop(manifest_key(source), None)
+        for source, entry in list(files.items()):
+            if not path.isfile(entry['dest']):
+                del files[source]
+        save_manifest(outdir, manifest)
+    return manifest
+
+
+def manifest_key(source):
+    """
+    The key of `source` in a loaded manifest: its path relative to the
+    working directory, or its absolute path if it has none.
+    """
+    try:
+        return path.relpath(source)
+    except ValueError:
+        return path.abspath(source)
+
+
+def _relative(name, start):
+    # Paths on another drive than `start` are kept absolute.
+    try:
+        return path.relpath(name, start)
+    except ValueError:
+        return path.abspath(name)
+
+
+def _convert_pages(entry, convert):
+    """
+    A copy of the manifest `entry` with `convert` applied to the paths of the
+    pages it names.
+    """
+    entry = dict(entry, dest=convert(entry['dest']))
+    if 'refs' in entry:
+        entry['refs'] = [[name, anchor, None if dest is None else convert(dest)]
+                         for name, anchor, dest in entry['refs']]
+    return entry
+
+
+@contextmanager
+def _locked(outdir):
+    """
+    Hold the lock file of the manifest in `outdir`.
+    """
+    lock = path.join(outdir, LOCK_NAME)
+    while True:
+        try:
+            os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            break
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        try:
+            if time.time() - path.getmtime(lock) > LOCK_TIMEOUT:
+                os.remove(lock)
+        except OSError:
+            pass
+        time.sleep(0.01)
+
+    try:
+        yield
+    finally:
+        os.remove(lock)
+
+
+def source_hash(data):
+    """
+    Hash the raw bytes of a source file.
+    """
+    return hashlib.sha1(data).hexdigest()
+
+
+def is_current(entry, digest, options, dest):
+    """
+    Is the documentation recorded by manifest `entry` still up to date for a
+    source with hash `digest`, rendered with `options` to `dest`?
+    """
+    if entry is None:
+        return False
+    recorded = (entry.get('hash'), entry.get('options'), entry.get('dest'))
+    current = (digest, options, path.normpath(dest))
+    return recorded == current and path.isfile(dest)
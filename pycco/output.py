@@ -0,0 +1,324 @@
+"""
+Writing the documentation to disk.
+
+Every file Pycco writes goes through `write_file()`, which leaves a file
+untouched when it already holds exactly the bytes that would be written, so
+an unchanged page keeps its mtime and tools that sync the output directory
+elsewhere only ever see the pages that really changed.
+
+New contents are streamed into a temporary file beside the destination and
+then compared with the existing file, by size first and by hash only when
+the sizes agree. A changed file is renamed over the old one, so a reader, or
+a build that crashes halfway, never leaves a truncated page behind.
+
+For static serving, pages and stylesheets can be compacted with
+`minify_html()` and `minify_css()`, and `compress_file()` writes the gzip
+(and, when the `brotli` package is installed, brotli) compressed copies that
+web servers such as nginx can send as they are, with `gzip_static`.
+
+Code that renders pages itself, like `Builder`, hands them to a sink: a
+`FileSink` writing into a directory, a `MemorySink` keeping them in a
+dictionary, or a `ZipSink` adding them to a zip archive.
+"""
+import errno
+import gzip
+import hashlib
+import io
+import os
+import posixpath
+import re
+import threading
+import zipfile
+from os import path
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+__all__ = ('write_file', 'make_directories', 'minify_html', 'minify_css',
+           'compress_file', 'compressed_names', 'sink_name', 'FileSink',
+           'MemorySink', 'ZipSink')
+
+# The directories known to exist, so each one is only created once.
+_directories = set()
+
+_block_size = 64 * 1024
+
+
+def make_directories(directory):
+    """
+    Make sure `directory` and its parents exist.
+    """
+    if not directory or directory in _directories:
+        return
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST or not path.isdir(directory):
+            raise
+    _directories.add(directory)
+
+
+def _same_contents(filename, size, digest):
+    """
+    Does `filename` hold `size` bytes hashing to `digest`?
+    """
+    try:
+        if os.stat(filename).st_size != size:
+            return False
+        existing = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(_block_size), b''):
+                existing.update(block)
+    except (IOError, OSError):
+        return False
+    return existing.digest() == digest
+
+
+def _replace(temp, filename):
+    try:
+        os.rename(temp, filename)
+    except OSError:
+        # On platforms where `rename` won't replace an existing file.
+        os.remove(filename)
+        os.rename(temp, filename)
+
+
+def write_file(filename, chunks):
+    """
+    Write `chunks`, a bytestring or an iterable of them, to `filename`,
+    unless the file already holds exactly those bytes. Returns whether the
+    file was written.
+    """
+    if isinstance(chunks, bytes):
+        chunks = (chunks,)
+    directory = path.dirname(filename)
+    make_directories(directory)
+
+    temp = path.join(directory, '.{}.{}-{}.tmp'.format(
+        path.basename(filename), os.getpid(), threading.current_thread().ident))
+    digest = hashlib.sha1()
+    size = 0
+    try:
+        f = open(temp, 'wb')
+    except (IOError, OSError) as e:
+        # The directory was removed since it was made, say between the
+        # builds of a watch.
+        if e.errno != errno.ENOENT:
+            raise
+        _directories.discard(directory)
+        make_directories(directory)
+        f = open(temp, 'wb')
+
+    try:
+        with f:
+            for chunk in chunks:
+                f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+        if _same_contents(filename, size, digest.digest()):
+            os.remove(temp)
+            return False
+        _replace(temp, filename)
+    except BaseException:
+        try:
+            os.remove(temp)
+        except OSError:
+            pass
+        raise
+    return True
+
+
+# === Minifying ===
+
+# Elements whose contents are kept exactly as they are.
+_raw_element = re.compile(
+    r'(<(pre|textarea|script|style)\b.*?</\2\s*>|<!--.*?-->|<[^>]*>)',
+    re.I | re.S)
+
+# Tags next to which whitespace is never rendered.
+_block_tag = re.compile(
+    r'<(!doctype|/?(html|head|title|meta|link|body|div|p|h[1-6]|ul|ol|li|dl|'
+    r'dt|dd|table|thead|tbody|tr|th|td|blockquote|hr|br|pre))\b', re.I)
+
+_whitespace = re.compile(r'[ \t\r\n\f]+')
+
+# A run of two or more spans of the same class, as Pygments writes them for
+# consecutive tokens of the same type.
+_span_run = re.compile(
+    r'<span class="([^"]+)">[^<]*</span>(?:<span class="\1">[^<]*</span>)+')
+_span_tag = re.compile(r'</?span[^>]*>')
+
+
+def _merge_spans(match):
+    return u'<span class="{}">{}</span>'.format(
+        match.group(1), _span_tag.sub(u'', match.group(0)))
+
+
+def minify_html(html):
+    """
+    Compact `html` without changing how it renders. Runs of whitespace in
+    text are collapsed to a single space, or dropped next to block-level
+    tags, and neighbouring spans of the same class in preformatted code are
+    merged. Preformatted text is otherwise left exactly as it is.
+    """
+    parts = _raw_element.split(html)
+    # `split()` gives text, then each tag along with its element name.
+    texts, tags = parts[0::3], parts[1::3]
+    out = []
+    for i, text in enumerate(texts):
+        text = _whitespace.sub(u' ', text)
+        if text == u' ' or not text:
+            before = tags[i - 1] if i else u''
+            after = tags[i] if i < len(tags) else u''
+            if not i or i == len(tags) or _block_tag.match(before) or _block_tag.match(after):
+                text = u''
+        else:
+            if not i or _block_tag.match(tags[i - 1]):
+                text = text.lstrip(u' ')
+            if i == len(tags) or _block_tag.match(tags[i]):
+                text = text.rstrip(u' ')
+        out.append(text)
+        if i < len(tags):
+            tag = tags[i]
+            if tag[:4].lower() == u'<pre':
+                tag = _span_run.sub(_merge_spans, tag)
+            out.append(tag)
+    return u''.join(out)
+
+
+_css_part = re.compile(r'("[^"]*"|\'[^\']*\'|/\*.*?\*/)', re.S)
+_css_space = re.compile(r'\s*([{};,])\s*|(:)\s+')
+
+
+def minify_css(css):
+    """
+    Compact `css`, dropping its comments and the whitespace that does not
+    matter. Quoted strings are left alone.
+    """
+    out = []
+    for i, part in enumerate(_css_part.split(css)):
+        if i % 2:
+            if not part.startswith(u'/*'):
+                out.append(part)
+            continue
+        part = _whitespace.sub(u' ', part)
+        out.append(_css_space.sub(lambda m: m.group(1) or m.group(2), part))
+    return u''.join(out).replace(u';}', u'}').strip()
+
+
+# === Compressing ===
+
+# The suffixes of the compressed copies of a file.
+COMPRESSED_SUFFIXES = ('.gz', '.br')
+
+
+def compressed_names(filename):
+    """
+    The names of the compressed copies of `filename` that are written.
+    """
+    suffixes = COMPRESSED_SUFFIXES if brotli is not None else ('.gz',)
+    return [filename + suffix for suffix in suffixes]
+
+
+def _gzip(data):
+    buf = io.BytesIO()
+    # No timestamp, so that the same page always compresses the same.
+    with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return buf.getvalue()
+
+
+def compress_file(filename):
+    """
+    Write the compressed copies of `filename` beside it, unless they are at
+    least as new as it is already.
+    """
+    mtime = os.stat(filename).st_mtime
+    stale = []
+    for name in compressed_names(filename):
+        try:
+            if os.stat(name).st_mtime >= mtime:
+                continue
+        except OSError:
+            pass
+        stale.append(name)
+    if not stale:
+        return
+
+    with open(filename, 'rb') as f:
+        data = f.read()
+    for name in stale:
+        if name.endswith('.gz'):
+            write_file(name, _gzip(data))
+        else:
+            write_file(name, brotli.compress(data))
+
+
+# === Sinks ===
+#
+# A sink takes pages by their name relative to the output directory, always
+# with `/` separators, through `write(name, data)`, and is done with once
+# `close()` is called. Names that would lead out of the output directory are
+# refused, since they may come from paths a program was handed.
+
+def sink_name(name):
+    """
+    Normalise the page name `name`, raising `ValueError` if it is absolute or
+    leads out of the output directory.
+    """
+    normal = posixpath.normpath(name.replace(os.sep, '/'))
+    outside = normal in ('.', '..') or normal.startswith('../')
+    if outside or posixpath.isabs(normal) or path.splitdrive(normal)[0]:
+        raise ValueError('Not a page name inside the output: {}'.format(name))
+    return normal
+
+
+class FileSink(object):
+    """
+    Write pages into `directory`, leaving those that have not changed alone.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def write(self, name, data):
+        name = sink_name(name)
+        return write_file(path.join(self.directory, *name.split('/')), data)
+
+    def close(self):
+        pass
+
+
+class MemorySink(dict):
+    """
+    Keep pages in memory, as a dictionary from their names to their bytes.
+    """
+
+    def write(self, name, data):
+        changed = self.get(name) != data
+        self[name] = data
+        return changed
+
+    def close(self):
+        pass
+
+
+class ZipSink(object):
+    """
+    Add pages to the zip archive `file`, a file name or a file object. A page
+    written twice is stored twice, and the archive is only complete once the
+    sink is closed.
+    """
+
+    def __init__(self, file, compression=zipfile.ZIP_DEFLATED):
+        self.archive = zipfile.ZipFile(file, 'w', compression)
+
+    def write(self, name, data):
+        self.archive.writestr(sink_name(name), data)
+        return True
+
+    def close(self):
+        self.archive.close()
@@ -0,0 +1,233 @@
+"""
+Per-phase profiling of a build, for `pycco --profile`.
+
+While profiling is on, each phase of documenting a file (reading it, finding
+its language, parsing, Pygments, Markdown, templating and writing) is recorded
+as an event with its wall time and, optionally, the peak memory traced while
+it ran. Worker processes record their own events and hand them back with
+their results, so the trace has one track per worker.
+
+The events are written in the Chrome trace format, which both
+`chrome://tracing` and Perfetto can open.
+
+While profiling is off, `phase()` hands back a shared do-nothing context
+manager, so the hooks in the build cost next to nothing.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import time
+
+__all__ = ('start', 'stop', 'recording', 'phase', 'source', 'take', 'merge',
+           'write_trace', 'summary')
+
+# The events recorded so far in this process, or `None` when not profiling.
+_events = None
+
+# Whether to trace memory allocations as well as time.
+_memory = False
+
+# The source file the phases being recorded belong to.
+_source = None
+
+
+def start(memory=False):
+    """
+    Start recording phases in this process, tracing memory too if `memory`.
+    """
+    global _events, _memory
+    _events = []
+    _memory = memory
+    if memory:
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+
+def stop():
+    """
+    Stop recording, returning whatever events were not taken yet.
+    """
+    global _events, _memory
+    events, _events = _events or [], None
+    if _memory:
+        import tracemalloc
+        tracemalloc.stop()
+        _memory = False
+    return events
+
+
+def recording():
+    """
+    Are phases being recorded in this process?
+    """
+    return _events is not None
+
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_null_context = _NullContext()
+
+
+class _Phase(object):
+    """
+    Record the time, and maybe the peak memory, of the block it guards.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        if _memory:
+            import tracemalloc
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        end = time.time()
+        args = {'source': _source}
+        if _memory:
+            import tracemalloc
+            args['peak'] = tracemalloc.get_traced_memory()[1]
+        _events.append({
+            'name': self.name,
+            'cat': 'phase',
+            'ph': 'X',
+            'ts': int(self.start * 1e6),
+            'dur': int((end - self.start) * 1e6),
+            'tid': os.getpid(),
+            'args': args,
+        })
+        return False
+
+
+class _Source(object):
+    """
+    Attribute the phases in the block it guards to a source file, and record
+    the whole block as an event of its own.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        global _source
+        self.outer, _source = _source, self.name
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _source
+        end = time.time()
+        _source = self.outer
+        _events.append({
+            'name': self.name,
+            'cat': 'file',
+            'ph': 'X',
+            'ts': int(self.start * 1e6),
+            'dur': int((end - self.start) * 1e6),
+            'tid': os.getpid(),
+            'args': {'source': self.name},
+        })
+        return False
+
+
+def phase(name):
+    """
+    A context manager recording the phase `name` of the current source.
+    """
+    if _events is None:
+        return _null_context
+    return _Phase(name)
+
+
+def source(name):
+    """
+    A context manager attributing the phases within it to the source `name`.
+    """
+    if _events is None:
+        return _null_context
+    return _Source(name)
+
+
+def take():
+    """
+    Hand over the events recorded so far, to send them back to `process()`.
+    """
+    global _events
+    if _events is None:
+        return None
+    events, _events = _events, []
+    return events
+
+
+def merge(events):
+    """
+    Add events recorded elsewhere, such as those of a chunk of a huge source
+    highlighted by another process, to those of this process.
+    """
+    if _events is None or not events:
+        return
+    for event in events:
+        if event['args'].get('source') is None:
+            event['args']['source'] = _source
+    _events.extend(events)
+
+
+def write_trace(filename, events):
+    """
+    Write `events` to `filename` as a Chrome trace, naming each process's
+    track after it.
+    """
+    pid = os.getpid()
+    metadata = [{
+        'name': 'thread_name',
+        'ph': 'M',
+        'pid': pid,
+        'tid': tid,
+        'args': {'name': 'main' if tid == pid else 'worker {}'.format(tid)},
+    } for tid in sorted(set(event['tid'] for event in events))]
+    trace = {
+        'traceEvents': metadata + [dict(event, pid=pid) for event in events],
+        'displayTimeUnit': 'ms',
+    }
+    with open(filename, 'w') as f:
+        json.dump(trace, f, separators=(',', ':'))
+
+
+def summary(events, top=10):
+    """
+    Lines summing up the `top` slowest files and the total time of each
+    phase across the build.
+    """
+    files = sorted((event for event in events if event['cat'] == 'file'),
+                   key=lambda event: -event['dur'])
+    phases = {}
+    peaks = {}
+    for event in events:
+        if event['cat'] == 'phase':
+            phases[event['name']] = phases.get(event['name'], 0) + event['dur']
+            if 'peak' in event['args']:
+                peaks[event['name']] = max(peaks.get(event['name'], 0),
+                                           event['args']['peak'])
+
+    lines = ['Slowest files:']
+    for event in files[:top]:
+        lines.append('  {:>10.1f} ms  {}'.format(event['dur'] / 1000.0, event['name']))
+    lines.append('Time per phase:')
+    for name in sorted(phases, key=lambda name: -phases[name])[:top]:
+        line = '  {:>10.1f} ms  {}'.format(phases[name] / 1000.0, name)
+        if name in peaks:
+            line += ' (peak {:.1f} MB)'.format(peaks[name] / 1048576.0)
+        lines.append(line)
+    return lines
@@ -0,0 +1,275 @@
+"""
+A small HTTP server for browsing documentation without building it first,
+for `pycco serve`.
+
+Request paths are mapped back to sources through `destination()`, the same
+way a build names its output, and each page is rendered the first time it is
+asked for. Rendered pages are kept in a `PageCache` of bounded size, and are
+rendered again only once their source has changed. The index is built when
+it is first asked for, and requests are handled on a pool of threads, which
+keep their Pygments and Markdown state warm from one page to the next.
+
+The tree of sources is walked when it is first needed, and again at most
+once every `rescan_interval` seconds, when the index or a page that isn't
+known yet is asked for; other requests never walk it.
+"""
+from __future__ import absolute_import, print_function
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from os import path
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from urllib.parse import unquote, urlsplit
+except ImportError:
+    from urllib import unquote
+    from urlparse import urlsplit
+
+from pycco.generate_index import generate_index
+from pycco.main import _generate_documentation, _iter_sources, destination
+from pycco_resources import css as pycco_css
+
+__all__ = ('serve', 'make_server', 'PageCache')
+
+# The size limit of the page cache, in bytes.
+DEFAULT_CACHE_SIZE = 64 * 1024 * 1024
+
+# The least time in seconds between two walks of the tree of sources.
+DEFAULT_RESCAN_INTERVAL = 2.0
+
+# Pages are rendered relative to this virtual output directory, which request
+# paths are resolved against too.
+ROOT = '.'
+
+
+class PageCache(object):
+    """
+    A thread-safe cache of rendered pages, evicting the least recently used
+    ones beyond `max_size` bytes. Each page is stored along with the mtime,
+    size and hash of the source it was rendered from.
+    """
+
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self.size = 0
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        The entry for `key` as `(stat, digest, page)`, or `None`.
+        """
+        with self.lock:
+            entry = self.pages.pop(key, None)
+            if entry is not None:
+                self.pages[key] = entry
+            return entry
+
+    def put(self, key, stat, digest, page):
+        with self.lock:
+            old = self.pages.pop(key, None)
+            if old is not None:
+                self.size -= len(old[2])
+            self.pages[key] = (stat, digest, page)
+            self.size += len(page)
+            while self.size > self.max_size and len(self.pages) > 1:
+                _, evicted = self.pages.popitem(last=False)
+                self.size -= len(evicted[2])
+
+
+class _Site(object):
+    """
+    The documentation being served: which sources there are, and how to
+    render their pages.
+    """
+
+    def __init__(self, sources, preserve_paths=True, language=None,
+                 encoding='utf8', include=None, exclude=None,
+                 cache_size=DEFAULT_CACHE_SIZE,
+                 rescan_interval=DEFAULT_RESCAN_INTERVAL):
+        self.sources = sources
+        self.preserve_paths = preserve_paths
+        self.language = language
+        self.encoding = encoding
+        self.include = include
+        self.exclude = exclude
+        self.cache = PageCache(cache_size)
+        self.rescan_interval = rescan_interval
+        self.lock = threading.Lock()
+        self.walk_lock = threading.Lock()
+        self.pages = None
+        self.walked = None
+        self.index = None
+
+    def discover(self):
+        """
+        Walk the sources again, mapping each page to the source it documents.
+        """
+        pages = {}
+        for source in _iter_sources(self.sources, include=self.include,
+                                    exclude=self.exclude):
+            dest = destination(source, preserve_paths=self.preserve_paths,
+                               outdir=ROOT)
+            pages.setdefault(path.normpath(dest), source)
+        with self.lock:
+            self.walked = time.time()
+            if pages != self.pages:
+                self.pages = pages
+                self.index = None
+        return pages
+
+    def current_pages(self):
+        """
+        The pages and their sources, walking the sources again only if they
+        were last walked over `rescan_interval` seconds ago. One thread walks
+        while the others wait for it.
+        """
+        with self.walk_lock:
+            if self.walked is None or time.time() - self.walked >= self.rescan_interval:
+                return self.discover()
+            return self.pages
+
+    def source_for(self, page):
+        """
+        The source documented by `page`, looking for new sources if it is not
+        one we know of yet.
+        """
+        if not page.endswith('.html'):
+            return None
+        pages = self.pages
+        if pages is None or page not in pages:
+            pages = self.current_pages()
+        return pages.get(page)
+
+    def render_index(self):
+        self.current_pages()
+        index = self.index
+        if index is None:
+            index = generate_index(sorted(self.pages), ROOT)
+            self.index = index
+        return index
+
+    def render(self, source):
+        """
+        The page documenting `source`, rendered again only if the source has
+        changed since it was last rendered.
+        """
+        st = os.stat(source)
+        stat = (st.st_mtime, st.st_size)
+        cached = self.cache.get(source)
+        if cached is not None and cached[0] == stat:
+            return cached[2]
+
+        with open(source, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha1(data).hexdigest()
+        # Touching a file changes its mtime but not what it documents.
+        if cached is not None and cached[1] == digest:
+            page = cached[2]
+        else:
+            page = _generate_documentation(source, data.decode(self.encoding),
+                                           ROOT, self.preserve_paths,
+                                           self.language)
+        self.cache.put(source, stat, digest, page)
+        return page
+
+    def respond(self, url):
+        """
+        The status, content type and body of the response to `url`.
+        """
+        page = path.normpath(unquote(urlsplit(url).path).lstrip('/') or 'index.html')
+        if page == 'pycco.css':
+            return 200, 'text/css', pycco_css.encode('utf-8')
+        if page == 'index.html':
+            return 200, 'text/html', self.render_index()
+
+        source = self.source_for(page)
+        if source is None:
+            return 404, None, None
+        try:
+            return 200, 'text/html', self.render(source)
+        except (IOError, OSError):
+            return 404, None, None
+        except (ValueError, UnicodeDecodeError) as e:
+            return 500, 'text/plain', u'{}: {}\n'.format(source, e).encode('utf-8')
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self, head=False):
+        status, content_type, body = self.server.site.respond(self.path)
+        if body is None:
+            self.send_error(status)
+            return
+        self.send_response(status)
+        self.send_header('Content-Type', content_type + '; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def log_message(self, format, *args):
+        print('pycco serve: ' + format % args)
+
+
+class _PooledHTTPServer(HTTPServer):
+    """
+    An HTTP server handling its requests on a fixed pool of threads, instead
+    of starting a thread for each one.
+    """
+
+    def __init__(self, address, site, threads):
+        HTTPServer.__init__(self, address, _Handler)
+        self.site = site
+        self.pool = ThreadPool(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.apply_async(self._process, (request, client_address))
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.terminate()
+        self.pool.join()
+
+
+def make_server(sources, host='127.0.0.1', port=8000, threads=4, **options):
+    """
+    Create the server for `sources` without starting it; `options` are those
+    of `_Site`.
+    """
+    return _PooledHTTPServer((host, port), _Site(sources, **options), threads)
+
+
+def serve(sources, host='127.0.0.1', port=8000, threads=4, **options):
+    """
+    Serve the documentation of `sources` until interrupted.
+    """
+    server = make_server(sources, host=host, port=port, threads=threads,
+                         **options)
+    print('pycco: serving on http://{}:{}/'.format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
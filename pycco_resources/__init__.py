@@ -1,4 +1,9 @@
-import pystache
+import re
+
+try:
+    from html import escape as _escape
+except ImportError:
+    from cgi import escape as _escape
 
 css = """\
 /*--------------------- Layout and Typography ----------------------------*/
@@ -240,7 +245,109 @@ html = """\
 """
 
 
+# === Compiled templates ===
+#
+# Pages are rendered from a small subset of [Mustache][mustache]: escaped
+# `{{ name }}` and raw `{{{ name }}}` variables, and `{{#name}}` sections
+# over lists or dictionaries. The template is compiled once into a tree of
+# parts, and values are inserted verbatim, so code that happens to contain
+# `{{` needs no escaping.
+#
+# [mustache]: https://mustache.github.io/mustache.5.html
+
+# A section tag alone on its line takes the whole line with it, as in Mustache.
+_standalone_tag = re.compile(r"^[ \t]*(\{\{[#/][^}]*\}\})[ \t]*\n", re.M)
+_tag = re.compile(r"\{\{\{\s*(.+?)\s*\}\}\}|\{\{\s*([#/]?)\s*(.+?)\s*\}\}")
+
+
+def compile_template(source):
+    """
+    Compile Mustache `source` into a list of parts: text, `("var", name)`,
+    `("raw", name)` and `("section", name, parts)`.
+    """
+    source = _standalone_tag.sub(r"\1", source)
+    parts = []
+    stack = []
+    position = 0
+    for match in _tag.finditer(source):
+        if match.start() > position:
+            parts.append(source[position:match.start()])
+        position = match.end()
+
+        raw, kind, name = match.groups()
+        if raw:
+            parts.append(("raw", raw))
+        elif kind == "#":
+            stack.append((name, parts))
+            parts = []
+        elif kind == "/":
+            opened, outer = stack.pop()
+            if opened != name:
+                raise ValueError("Unbalanced template section: {}".format(name))
+            outer.append(("section", name, parts))
+            parts = outer
+        else:
+            parts.append(("var", name))
+
+    if stack:
+        raise ValueError("Unclosed template section: {}".format(stack[-1][0]))
+    if position < len(source):
+        parts.append(source[position:])
+    return parts
+
+
+def _lookup(contexts, name):
+    for context in reversed(contexts):
+        if isinstance(context, dict) and name in context:
+            return context[name]
+    return None
+
+
+def _render(parts, contexts):
+    for part in parts:
+        if not isinstance(part, tuple):
+            yield part
+            continue
+
+        value = _lookup(contexts, part[1])
+        if part[0] == "section":
+            if isinstance(value, dict):
+                value = [value]
+            elif not value:
+                continue
+            for item in value:
+                contexts.append(item)
+                for chunk in _render(part[2], contexts):
+                    yield chunk
+                contexts.pop()
+        elif value is not None:
+            if not isinstance(value, type(u"")):
+                value = u"{}".format(value)
+            yield _escape(value, quote=True) if part[0] == "var" else value
+
+
+class Template(object):
+    """
+    A page template, compiled once and rendered for each page.
+    """
+
+    def __init__(self, source):
+        self.parts = compile_template(source)
+
+    def render_iter(self, context):
+        """
+        Render the template for `context` a piece at a time. Sections are
+        consumed lazily, so `context` may hold generators.
+        """
+        return _render(self.parts, [context])
+
+    def __call__(self, context):
+        return u"".join(self.render_iter(context))
+
+
 def template(source):
-    return lambda context: pystache.render(source, context)
+    return Template(source)
+
+
 # Create the template that we will use to generate the Pycco HTML page.
 pycco_template = template(html)
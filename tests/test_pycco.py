@@ -1,8 +1,10 @@
 from __future__ import absolute_import
 
 import copy
+import json
 import os
 import os.path
+import re
 import tempfile
 import time
 
@@ -10,15 +12,22 @@ import pytest
 
 import pycco.generate_index as generate_index
 import pycco.main as p
-from hypothesis import assume, example, given
+from hypothesis import assume, example, given, settings
 from hypothesis.strategies import booleans, lists, none, text, sampled_from, data
-from pycco.languages import supported_languages
+from pycco.cache import PRUNE_STAMP, SectionCache
+from pycco.languages import supported_filenames, supported_languages
+from pycco.manifest import load_manifest
 
 try:
     from unittest.mock import patch
 except ImportError:
     from mock import patch
 
+try:
+    from time import process_time
+except ImportError:
+    from time import clock as process_time
+
 
 
 PYTHON = supported_languages['.py']
@@ -91,8 +100,15 @@ def test_get_language_specify_language(source, code):
         p.get_language(source, code, language_name="non-existent")
 
 
+# Pygments loads its lexers on first use, which can blow the deadline of
+# whichever example happens to run first.
+@settings(deadline=None)
 @given(text() | none())
 def test_get_language_bad_source(source):
+    # Names that do identify a language aren't bad sources.
+    name = os.path.basename(source or "")
+    assume(not any(name.endswith(ext) for ext in supported_languages))
+    assume(name not in supported_filenames)
     code = "#!/usr/bin/python\n"
     code += FOO_FUNCTION
     assert p.get_language(source, code) == PYTHON
@@ -163,6 +179,7 @@ def test_generate_documentation():
     p.generate_documentation(PYCCO_SOURCE, outdir=tempfile.gettempdir())
 
 
+@settings(deadline=None)
 @given(booleans(), booleans(), data())
 def test_process(preserve_paths, index, data):
     lang_name = data.draw(sampled_from([l["name"] for l in supported_languages.values()]))
@@ -190,6 +207,7 @@ paths = lists(one_or_more_chars, min_size=1, max_size=30)
     lists(paths, min_size=1, max_size=255),
     lists(one_or_more_chars, min_size=1, max_size=255)
 )
+@example(path_lists=[['entry']], outdir_list=['0'])
 def test_generate_index(path_lists, outdir_list):
     file_paths = [os.path.join(*path_list) for path_list in path_lists]
     outdir = os.path.join(*outdir_list)
@@ -217,3 +235,815 @@ def test_flatten_sources(tmpdir):
 
     # Make sure that the lists are the same
     assert sorted(expected_sources) == sorted(flattened)
+
+
+def test_process_jobs_matches_serial(tmpdir):
+    src = tmpdir.mkdir("src")
+    for name in ["a.py", "b.py", "c.py"]:
+        src.join(name).write("# Docs for {}\n".format(name) + FOO_FUNCTION)
+    src.join("bad.py").write_binary(b"\xff\xfe")
+
+    serial, parallel = tmpdir.mkdir("serial"), tmpdir.mkdir("parallel")
+    p.process([str(src)], outdir=str(serial), preserve_paths=False, skip=True)
+    p.process([str(src)], outdir=str(parallel), preserve_paths=False,
+              skip=True, jobs=2)
+
+    for name in ["a.html", "b.html", "c.html", "pycco.css"]:
+        assert serial.join(name).read() == parallel.join(name).read()
+
+    with pytest.raises(UnicodeDecodeError):
+        p.process([str(src)], outdir=str(parallel), preserve_paths=False,
+                  jobs=2)
+
+
+def test_process_chunks_huge_sources(tmpdir, monkeypatch):
+    monkeypatch.chdir(tmpdir)
+    src = tmpdir.mkdir("src")
+    huge = "".join("# Docs {}\n".format(i) + FOO_FUNCTION.replace("foo", "f{}".format(i)) + "\n"
+                   for i in range(200))
+    huge = huge.replace("# Docs 150\n", "# === Late ===\nlate = 1\n# See [[src/lib/small.py]].\n")
+    src.join("huge.py").write('"""Module docs."""\nimport os\n' + huge)
+    src.mkdir("lib").join("small.py").write("# Small\n" + FOO_FUNCTION)
+
+    assert p.process(["src"], outdir="serial", check_links=True) == []
+    serial_html = p.generate_documentation("src/huge.py", outdir="serial")
+    with patch.object(p, 'chunk_threshold', 1000):
+        python = p.supported_languages[".py"]
+        assert len(p._chunk_sections(p.parse(huge, python), 8, python)) == 8
+        # Never cut inside a triple-quoted string.
+        assert len(p._chunk_sections(p.parse('x = """\n' + huge, python), 8, python)) == 1
+        assert p.process(["src"], outdir="parallel", jobs=2, check_links=True) == []
+        html = p.generate_documentation("src/huge.py", outdir="serial", jobs=2)
+
+    serial, parallel = tmpdir.join("serial"), tmpdir.join("parallel")
+    for name in [("src", "huge.html"), ("src", "lib", "small.html")]:
+        assert serial.join(*name).read() == parallel.join(*name).read()
+    assert 'href="lib/small.html"' in parallel.join("src", "huge.html").read()
+    entries = [load_manifest(d.basename)["files"][os.path.join("src", "huge.py")]
+               for d in (serial, parallel)]
+    assert entries[1]["refs"] == [["src/lib/small.py", None,
+                                   os.path.join("parallel", "src", "lib", "small.html")]]
+    assert entries[0]["anchors"] == entries[1]["anchors"] == ["late"]
+    assert html == serial_html
+
+
+def test_process_profile(tmpdir, capsys):
+    source = tmpdir.join("a.py")
+    source.write("# Docs\n" + FOO_FUNCTION)
+    trace = tmpdir.join("trace.json")
+    p.process([str(source)], outdir=str(tmpdir.join("docs")),
+              preserve_paths=False, profile=str(trace))
+
+    events = json.loads(trace.read())["traceEvents"]
+    phases = [e["name"] for e in events if e.get("cat") == "phase"]
+    assert phases == ["read", "language", "parse", "pygments", "markdown",
+                      "template", "write"]
+    assert [e["name"] for e in events if e.get("cat") == "file"] == [str(source)]
+    assert "Time per phase:" in capsys.readouterr().out
+    assert not p.profiling.recording()
+
+
+def test_process_leaves_unchanged_output_alone(tmpdir):
+    source = tmpdir.join("a.py")
+    source.write("# Docs\n" + FOO_FUNCTION)
+    docs = tmpdir.join("docs")
+    p.process([str(source)], outdir=str(docs), preserve_paths=False)
+    for output in docs.listdir():
+        output.setmtime(1000000000)
+
+    p.process([str(source)], outdir=str(docs), preserve_paths=False, force=True)
+    assert all(output.mtime() == 1000000000 for output in docs.listdir())
+
+    source.write("# Other docs\n" + FOO_FUNCTION)
+    p.process([str(source)], outdir=str(docs), preserve_paths=False)
+    assert "Other docs" in docs.join("a.html").read()
+    assert docs.join("pycco.css").mtime() == 1000000000
+    assert not [f for f in docs.listdir() if f.basename.endswith(".tmp")]
+
+
+def test_write_file_keeps_old_contents_on_failure(tmpdir):
+    target = tmpdir.join("sub", "page.html")
+    assert p.write_file(str(target), b"old")
+    assert not p.write_file(str(target), [b"o", b"ld"])
+
+    def chunks():
+        yield b"half a page"
+        raise ValueError
+
+    with pytest.raises(ValueError):
+        p.write_file(str(target), chunks())
+    assert target.read() == "old"
+    assert [f.basename for f in target.dirpath().listdir()] == ["page.html"]
+
+
+def test_minify_html_keeps_rendering():
+    html = (u'<!DOCTYPE html>\n<html>\n  <body>\n    <div class="docs">\n'
+            u'      <p>Some <em>text</em>\n  and   <a href="#x">a link</a> </p>\n'
+            u'    </div>\n    <pre><code>  a\n\n  b</code></pre>\n'
+            u'    <div class="highlight"><pre><span class="n">a</span>'
+            u'<span class="n">b</span> <span class="o">=</span>'
+            u'<span class="n">c</span></pre></div>\n  </body>\n</html>\n')
+    assert p.minify_html(html) == (
+        u'<!DOCTYPE html><html><body><div class="docs">'
+        u'<p>Some <em>text</em> and <a href="#x">a link</a></p></div>'
+        u'<pre><code>  a\n\n  b</code></pre><div class="highlight"><pre>'
+        u'<span class="n">ab</span> <span class="o">=</span>'
+        u'<span class="n">c</span></pre></div></body></html>')
+    assert p.minify_css(u"/* Layout */\na:visited {\n  font: 'A  B', serif;\n}\n") == \
+        u"a:visited{font:'A  B',serif}"
+
+
+def test_process_minify_and_compress(tmpdir):
+    import gzip
+    source = tmpdir.join("a.py")
+    source.write("# Docs\n" + FOO_FUNCTION)
+    docs = tmpdir.join("docs")
+    p.process([str(source)], outdir=str(docs), preserve_paths=False,
+              index=True, minify=True, compress=True)
+
+    page = docs.join("a.html").read_binary()
+    assert b"\n<div" not in page
+    for name in ("a.html", "pycco.css", "index.html"):
+        with gzip.open(str(docs.join(name + ".gz"))) as f:
+            assert f.read() == docs.join(name).read_binary()
+
+    p._remove_documentation([str(source)], str(docs))
+    assert not docs.join("a.html").exists()
+    assert not docs.join("a.html.gz").exists()
+
+
+def test_builder_renders_lazily_into_sinks(tmpdir):
+    import zipfile
+    from pycco import Builder, FileSink, MemorySink, ZipSink
+    code = "# Docs\n" + FOO_FUNCTION
+    sink = MemorySink()
+    builder = Builder(sink=sink)
+    results = builder.build([("lib/a.py", code), ("b.unknown", "text"),
+                             ("b.py", code.encode("utf-8"))])
+    assert not sink
+
+    a = next(results)
+    assert a["name"] == "lib/a.html" and a["error"] is None
+    assert a["html"] == p._generate_documentation("lib/a.py", code, ".", True, None)
+    assert sorted(sink) == ["lib/a.html", "pycco.css"]
+    assert next(results)["error"] is not None
+    assert next(results)["name"] == "b.html"
+    assert sorted(sink) == ["b.html", "lib/a.html", "pycco.css"]
+
+    with patch.object(p, "_highlight_code", wraps=p._highlight_code) as pygments:
+        builder.render("lib/a.py", code.replace("Docs", "Other docs"))
+    assert not pygments.called
+    assert b"Other docs" in sink["lib/a.html"]
+
+    builder = Builder(sink=FileSink(str(tmpdir.join("docs"))), preserve_paths=False)
+    list(builder.build([("lib/a.py", code)]))
+    assert tmpdir.join("docs", "a.html").read_binary() == p._generate_documentation(
+        "lib/a.py", code, ".", False, None)
+
+    # Paths handed to a builder never lead out of its output.
+    builder = Builder(sink=FileSink(str(tmpdir.join("out", "docs"))))
+    escaped = builder.render("../../escaped.py", code)
+    assert escaped["error"] is not None and escaped["html"] is None
+    assert builder.render("/abs/./a.py", code)["name"] == "abs/a.html"
+    assert not tmpdir.join("escaped.html").exists()
+    for sink in (FileSink(str(tmpdir.join("docs"))), ZipSink(str(tmpdir.join("x.zip")))):
+        for name in ("../x.html", "/x.html", "a/../../x.html"):
+            with pytest.raises(ValueError):
+                sink.write(name, b"")
+
+    archive = tmpdir.join("docs.zip")
+    builder = Builder(sink=ZipSink(str(archive)))
+    list(builder.build([("lib/a.py", code)]))
+    builder.close()
+    assert sorted(zipfile.ZipFile(str(archive)).namelist()) == ["lib/a.html", "pycco.css"]
+
+    # A builder keeps its section cache to its size limit.
+    builder = Builder(cache_dir=str(tmpdir.join("cache")), keep=False)
+    with patch.object(SectionCache, "prune") as prune:
+        with patch("pycco.builder.PRUNE_INTERVAL", 2):
+            list(builder.build([("a.py", code), ("b.py", code), ("c.py", code)]))
+        assert prune.call_count == 1
+        builder.close()
+        assert prune.call_count == 2
+
+
+def test_highlight_in_chunks_keeps_other_languages_whole(tmpdir):
+    # A template literal around lines that would start a chunk in Python.
+    source = tmpdir.join("huge.js")
+    source.write("var tpl = `\n" + "".join(
+        "// Docs {0}\nclass C{0} {{\n  m() {{ return {0}; }}\n}}\n".format(i)
+        for i in range(50)) + "`;\n")
+    js = p.supported_languages[".js"]
+    sections = p.parse(source.read(), js)
+    assert len(p._chunk_sections(sections, 8, js)) == 1
+
+    serial = p.generate_documentation(str(source), outdir=str(tmpdir))
+    with patch.object(p, 'chunk_threshold', 100):
+        assert p.generate_documentation(str(source), outdir=str(tmpdir),
+                                        jobs=2) == serial
+
+
+def test_highlight_reuses_previous_sections():
+    python = p.supported_languages[".py"]
+    code = "".join("# Docs *{0}*\ndef f{0}():\n    return '{0}'\n\n".format(i)
+                   for i in range(50))
+    previous = p.highlight(p.parse(code, python), python, outdir="docs")
+
+    def rehighlight(edited):
+        with patch.object(p, '_highlight_code', wraps=p._highlight_code) as pygments:
+            with patch.object(p, 'render_markdown', wraps=p.render_markdown) as markdown:
+                sections = p.highlight(p.parse(edited, python), python,
+                                       outdir="docs", previous=previous)
+        assert sections == p.highlight(p.parse(edited, python), python, outdir="docs")
+        return pygments, markdown
+
+    pygments, markdown = rehighlight(code.replace("*20*", "*twenty*"))
+    assert not pygments.called and markdown.call_count == 1
+
+    pygments, markdown = rehighlight(code.replace("'20'", "'twenty' + 20"))
+    assert len(pygments.call_args[0][0]) == 1 and not markdown.called
+
+    # An unterminated string changes the highlighting of everything after it.
+    pygments, markdown = rehighlight(code.replace("'20'", '"""20'))
+    assert len(pygments.call_args[0][0]) == 30 and not markdown.called
+
+    # Outside of Python, a class can be inside a string, so the whole file
+    # is highlighted again; also once the string is closed in a later save.
+    js = p.supported_languages[".js"]
+    previous = None
+    for code in ["var tpl = 1;\n// Foo\nclass Foo {\n  m() {}\n}\n// Z\nvar z = 2;\n",
+                 "var tpl = `\n// Foo\nclass Foo {\n  m() {}\n}\n// Z\nvar z = 2;\n",
+                 "var tpl = `\n// Foo\nclass Foo {\n  m() {}\n}\n// Z\nvar z = `;\n"]:
+        sections = p.highlight(p.parse(code, js), js, outdir="docs",
+                               previous=previous)
+        assert sections == p.highlight(p.parse(code, js), js, outdir="docs")
+        previous = sections
+
+
+def test_regenerator_batches_and_removes(tmpdir):
+    src = tmpdir.mkdir("src")
+    a = src.join("a.py")
+    a.write("# Docs\n" + FOO_FUNCTION)
+    outdir = tmpdir.join("docs")
+    options = {"outdir": str(outdir), "preserve_paths": False, "index": True}
+    p.process([str(src)], **options)
+
+    regenerator = p._Regenerator([str(src)], options, delay=0.05)
+    assert regenerator.source_for(str(src.join(".git", "a.py"))) is None
+    assert regenerator.source_for(str(a)) == str(a)
+
+    with patch.object(p, 'process', wraps=p.process) as build:
+        regenerator.start()
+        for _ in range(3):
+            regenerator.changed(str(a))
+        time.sleep(0.5)
+        regenerator.stop()
+    assert build.call_count == 1
+
+    b = src.join("b.py")
+    a.rename(b)
+    regenerator.changed(str(a))
+    regenerator.changed(str(b))
+    regenerator.flush()
+    assert not outdir.join("a.html").exists()
+    assert outdir.join("b.html").exists()
+    index = outdir.join("index.html").read()
+    assert "b.html" in index and "a.html" not in index
+
+
+def test_regenerator_warms_unchanged_sources(tmpdir):
+    src = tmpdir.mkdir("src")
+    a = src.join("a.py")
+    code = "".join("# Docs {0}\ndef f{0}():\n    return {0}\n\n".format(i)
+                   for i in range(20))
+    a.write(code)
+    options = {"outdir": str(tmpdir.join("docs")), "preserve_paths": False}
+    p.process([str(src)], **options)
+
+    # The first build of a watch found nothing to render, and kept nothing.
+    kept = {}
+    p.process([str(src)], kept=kept, **options)
+    regenerator = p._Regenerator([str(src)], options, delay=0.05, kept=kept)
+    regenerator.warm()
+    regenerator.start()
+    try:
+        for _ in range(100):
+            if str(a) in kept:
+                break
+            time.sleep(0.05)
+        assert str(a) in kept
+
+        with patch.object(p, '_highlight_code', wraps=p._highlight_code) as pygments:
+            a.write(code.replace("return 10", "return 'ten'"))
+            regenerator.changed(str(a))
+            time.sleep(0.5)
+    finally:
+        regenerator.stop()
+    assert len(pygments.call_args[0][0]) == 1
+    assert "ten" in tmpdir.join("docs", "a.html").read()
+
+
+def test_serve_renders_pages_on_demand(tmpdir):
+    import threading
+    from pycco.server import make_server
+    try:
+        from urllib.request import urlopen
+        from urllib.error import HTTPError
+    except ImportError:
+        from urllib2 import HTTPError, urlopen
+
+    src = tmpdir.mkdir("src")
+    source = src.join("a.py")
+    source.write("# Docs\n" + FOO_FUNCTION)
+    server = make_server([str(src)], port=0, threads=2, preserve_paths=False)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = "http://127.0.0.1:{}/".format(server.server_address[1])
+    try:
+        with patch.object(p, 'highlight', wraps=p.highlight) as render:
+            page = urlopen(url + "a.html").read()
+            assert urlopen(url + "a.html").read() == page
+            assert render.call_count == 1
+        assert page == p.generate_documentation(str(source), outdir=".",
+                                                preserve_paths=False)
+
+        # A source that was touched but not changed keeps its page.
+        with patch.object(p, 'highlight', wraps=p.highlight) as render:
+            os.utime(str(source), (0, 0))
+            assert urlopen(url + "a.html").read() == page
+            assert render.call_count == 0
+
+            source.write("# New docs\n" + FOO_FUNCTION)
+            os.utime(str(source), (1, 1))
+            assert b"New docs" in urlopen(url + "a.html").read()
+            assert render.call_count == 1
+
+        assert b'href="a.html"' in urlopen(url).read()
+        assert urlopen(url + "pycco.css").read()
+        with pytest.raises(HTTPError):
+            urlopen(url + "b.html")
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_serve_walks_sources_sparingly(tmpdir):
+    from pycco import server
+    src = tmpdir.mkdir("src")
+    src.join("a.py").write("# Docs\n" + FOO_FUNCTION)
+    site = server._Site([str(src)], preserve_paths=False, rescan_interval=60)
+    with patch.object(server, '_iter_sources',
+                      wraps=server._iter_sources) as walk:
+        assert site.respond("/index.html")[0] == 200
+        assert site.respond("/a.html")[0] == 200
+        assert walk.call_count == 1
+
+        # Nothing but a page can be a source, and the tree was just walked.
+        src.join("b.py").write("# Docs\n" + FOO_FUNCTION)
+        assert site.respond("/favicon.ico")[0] == 404
+        assert site.respond("/b.html")[0] == 404
+        assert b"b.html" not in site.respond("/")[2]
+        assert walk.call_count == 1
+
+        site.walked -= 60
+        assert site.respond("/b.html")[0] == 200
+        assert b"b.html" in site.respond("/")[2]
+        assert walk.call_count == 2
+
+
+def test_index_lists_everything_documented(tmpdir):
+    src = tmpdir.mkdir("src")
+    for name in ["a.py", "b.py", "c.py"]:
+        src.join(name).write("# Docs\n" + FOO_FUNCTION)
+    outdir = tmpdir.join("docs")
+    p.process([str(src)], outdir=str(outdir), preserve_paths=False, index=True)
+
+    p.process([str(src.join("a.py"))], outdir=str(outdir),
+              preserve_paths=False, index=True)
+    index = outdir.join("index.html").read()
+    assert all(name in index for name in ["a.html", "b.html", "c.html"])
+
+    src.join("c.py").remove()
+    p.process([str(src.join("b.py"))], outdir=str(outdir),
+              preserve_paths=False, index=True)
+    index = outdir.join("index.html").read()
+    assert "a.html" in index and "b.html" in index and "c.html" not in index
+    assert not outdir.join(".pycco-manifest.lock").exists()
+
+
+def test_manifest_works_from_any_directory(tmpdir, monkeypatch):
+    src = tmpdir.mkdir("src")
+    for name in ["a.py", "b.py", "sub/m.py"]:
+        src.join(name).write("# Docs\n" + FOO_FUNCTION, ensure=True)
+    monkeypatch.chdir(tmpdir)
+    p.process(["src"], outdir="docs", preserve_paths=False, index=True)
+
+    monkeypatch.chdir(src)
+    with patch.object(p, '_document_sections') as generate:
+        p.process([os.path.join("sub", "m.py")], outdir=os.path.join("..", "docs"),
+                  preserve_paths=False, index=True)
+        assert not generate.called
+    index = tmpdir.join("docs", "index.html").read()
+    assert all(name in index for name in ["a.html", "b.html", "m.html"])
+    assert sorted(load_manifest(os.path.join("..", "docs"))["files"]) == [
+        "a.py", "b.py", os.path.join("sub", "m.py")]
+
+    # Pages of absolute sources are named with a doubled separator.
+    options = {"outdir": str(tmpdir.join("abs")), "check_links": True}
+    src.join("a.py").write("# See [[b.py]]\n" + FOO_FUNCTION)
+    assert p.process([str(src)], **options) == []
+    with patch.object(p, '_document_sections') as generate:
+        assert p.process([str(src)], **options) == []
+        assert not generate.called
+
+
+def test_sharded_index_keeps_index_sources(tmpdir):
+    pkg = tmpdir.join("src", "pkg")
+    pkg.ensure(dir=True)
+    pkg.join("index.js").write("// Entry point\nmain();\n")
+    pkg.join("util.js").write("// Helpers\nhelp();\n")
+    outdir = tmpdir.join("docs")
+    p.process([str(tmpdir.join("src"))], outdir=str(outdir),
+              index=True, sharded_index=True)
+
+    docs = outdir.join(str(pkg.join("index.html")).lstrip(os.sep))
+    assert "Entry point" in docs.read()
+    listing = docs.dirpath().join("_index.html").read()
+    assert 'href="index.html"' in listing and 'href="util.html"' in listing
+
+    with pytest.raises(ValueError):
+        list(generate_index.generate_index_pages(
+            [os.path.join(str(outdir), "_index.html")], str(outdir)))
+
+
+def test_sharded_index_pages(tmpdir):
+    outdir = str(tmpdir)
+    files = [os.path.join(outdir, *steps) for steps in
+             [("a.html",), ("pkg", "b.html"), ("pkg", "sub", "c.html")]]
+    pages = dict(generate_index.generate_index_pages(files, outdir))
+    assert sorted(pages) == [os.path.join(outdir, *steps) for steps in
+                             [("_index.html",), ("pkg", "_index.html"),
+                              ("pkg", "sub", "_index.html")]]
+
+    top = pages[os.path.join(outdir, "_index.html")].decode("utf-8")
+    assert 'href="a.html"' in top and 'href="pkg/_index.html"' in top
+    assert "b.html" not in top
+    sub = pages[os.path.join(outdir, "pkg", "sub", "_index.html")].decode("utf-8")
+    assert 'href="../../_index.html"' in sub and 'href="../_index.html">pkg' in sub
+    assert 'href="c.html"' in sub and 'href="../../pycco.css"' in sub
+
+    # A tree far deeper than the recursion limit.
+    deep = os.path.join(outdir, *(["d"] * 2000 + ["e.html"]))
+    assert len(generate_index.build_directories([deep], outdir)) == 2001
+
+
+def test_qualify_symbols_ends_blocks():
+    code = ("def first():\n    pass\n\n"
+            "try:\n    from os import scandir\nexcept ImportError:\n"
+            "    class Entry(object):\n        def is_dir(self):\n"
+            "            return (\n                False\n            )\n\n"
+            "        def stat(\n            self,\n        ):\n"
+            "            def inner():\n                pass\n\n"
+            "if True:\n    def scandir(path):\n        pass\n")
+    symbols = []
+    p.parse(code, PYTHON, symbols=symbols)
+    assert [name for name, _ in p.qualify_symbols(symbols)] == [
+        "first", "Entry", "Entry.is_dir", "Entry.stat", "Entry.stat.inner",
+        "scandir"]
+
+
+def test_process_resolves_and_checks_links(tmpdir, monkeypatch):
+    src = tmpdir.mkdir("src")
+    src.mkdir("lib").join("b.py").write(
+        "# === Usage ===\n" + FOO_FUNCTION +
+        "\n\n# A class\nclass Bar(object):\n    def baz(self):\n        pass\n")
+    src.join("a.py").write(
+        "# See [[b.py]], [[lib/b.py#usage]], [[b.py#nope]] and [[missing.py]]\n" +
+        FOO_FUNCTION + "\n# Uses [[b.Bar.baz]]\nx = 1\n")
+    monkeypatch.chdir(tmpdir)
+    outdir = tmpdir.join("docs")
+
+    for _ in range(2):
+        broken = p.process(["src"], outdir=str(outdir), check_links=True)
+        assert broken == [
+            (os.path.join("src", "a.py"), "b.py#nope", "no such section"),
+            (os.path.join("src", "a.py"), "missing.py", "no such file or symbol"),
+        ]
+
+    page = outdir.join("src", "a.html").read()
+    assert 'href="lib/b.html"' in page and 'href="lib/b.html#usage"' in page
+    assert 'href="lib/b.html#section-2"' in page
+
+    symbols = json.loads(outdir.join("pycco-symbols.json").read())
+    assert symbols["src.lib.b.Bar.baz"] == ["src/lib/b.html", 2]
+    assert symbols["b.foo"] == ["src/lib/b.html", 0]
+
+    # Adding the missing file fixes the link, without touching `a.py`.
+    src.join("missing.py").write("# Found\n" + FOO_FUNCTION)
+    broken = p.process(["src"], outdir=str(outdir), check_links=True)
+    assert broken == [(os.path.join("src", "a.py"), "b.py#nope", "no such section")]
+    assert 'href="missing.html"' in outdir.join("src", "a.html").read()
+
+    # A renamed symbol is reported by a build of its file alone, and a full
+    # build renders the unchanged pages linking to it again.
+    b = os.path.join("src", "lib", "b.py")
+    tmpdir.join(b).write(tmpdir.join(b).read().replace("def baz", "def qux"))
+    nope = (os.path.join("src", "a.py"), "b.py#nope", "no such section")
+    assert p.process([b], outdir=str(outdir), check_links=True) == [
+        nope, (os.path.join("src", "a.py"), "b.Bar.baz", "no such symbol")]
+    assert p.process(["src"], outdir=str(outdir), check_links=True) == [
+        nope, (os.path.join("src", "a.py"), "b.Bar.baz", "no such file or symbol")]
+    assert "section-2" not in outdir.join("src", "a.html").read()
+
+
+def test_process_skips_unchanged_sources(tmpdir):
+    source = tmpdir.join("a.py")
+    source.write("# Docs\n" + FOO_FUNCTION)
+    outdir = str(tmpdir.join("docs"))
+    p.process([str(source)], outdir=outdir, preserve_paths=False)
+
+    with patch.object(p, '_document_sections') as generate:
+        p.process([str(source)], outdir=outdir, preserve_paths=False)
+        assert not generate.called
+
+    # Changing the source or the options that affect its output, or forcing
+    # the build, renders the file again.
+    source.write("# Other docs\n" + FOO_FUNCTION)
+    p.process([str(source)], outdir=outdir, preserve_paths=False)
+    assert "Other docs" in tmpdir.join("docs", "a.html").read()
+
+    with patch.object(p, '_document_sections', return_value=[]) as generate:
+        p.process([str(source)], outdir=outdir, preserve_paths=False,
+                  encoding="latin-1")
+        p.process([str(source)], outdir=outdir, preserve_paths=False,
+                  encoding="latin-1", force=True)
+        assert generate.call_count == 2
+
+
+def test_highlight_with_section_cache(tmpdir):
+    cache = SectionCache(str(tmpdir))
+    code = open(PYCCO_SOURCE).read()
+    expected = p.highlight(p.parse(code, PYTHON), PYTHON,
+                           outdir=tempfile.gettempdir())
+
+    cold = p.highlight(p.parse(code, PYTHON), PYTHON,
+                       outdir=tempfile.gettempdir(), cache=cache)
+    with patch.object(p, '_highlight_code') as highlight_code, \
+            patch.object(p, 'render_markdown') as markdown:
+        warm = p.highlight(p.parse(code, PYTHON), PYTHON,
+                           outdir=tempfile.gettempdir(), cache=cache)
+        assert not highlight_code.called
+        assert not markdown.called
+
+    assert expected == cold == warm
+
+
+def test_section_cache_prune(tmpdir):
+    cache = SectionCache(str(tmpdir), max_size=100)
+    for i in range(10):
+        key = "{:040x}".format(i)
+        cache.put(key, "x" * 20)
+        os.utime(cache._path(key), (i, i))
+
+    # Reading an entry makes it the most recently used one.
+    assert cache.get("{:040x}".format(0)) == "x" * 20
+    cache.prune()
+
+    kept = [i for i in range(10) if cache.get("{:040x}".format(i)) is not None]
+    assert kept == [0, 7, 8, 9]
+
+    # Until an entry is added, the entries are not looked at again.
+    stamp = tmpdir.join(PRUNE_STAMP)
+    stamp.setmtime(stamp.mtime() + 10)
+    with patch('os.walk', wraps=os.walk) as walk:
+        cache.prune()
+        assert not walk.called
+        cache.put("f" * 40, "x" * 20)
+        tmpdir.join("ff").setmtime(stamp.mtime() + 10)
+        cache.prune()
+        assert walk.called
+
+
+@given(lists(sampled_from([
+    "Some *emphasis* and `code`.",
+    "A footnote[^1].\n\n[^1]: The note.",
+    "A [reference link][ref].\n\n[ref]: http://example.com",
+    "    indented code",
+    "```\nfenced\n```",
+    "\"Smart\" quotes -- and dashes...",
+    "",
+])))
+def test_render_markdown_matches_fresh_instance(texts):
+    from markdown import markdown
+    for text in texts:
+        assert p.render_markdown(text) == markdown(
+            text, extensions=p.markdown_extensions)
+
+
+def render_docs_slowly(text):
+    return p.render_markdown(p.preprocess(text, outdir=tempfile.gettempdir()))
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "\n",
+    "A plain sentence.\n",
+    "Two lines\nof one paragraph.\n",
+    "First paragraph.\n\n  \nSecond one, with (parens): and/or more?\n",
+    "Salt & pepper!\n",
+    u"Café naïve résumé.\n",
+])
+def test_plain_text_html_matches_markdown(text):
+    assert p.plain_text_html(text) == render_docs_slowly(text)
+
+
+@pytest.mark.parametrize("text", [
+    "Some *emphasis*.\n",
+    "snake_case\n",
+    "1. A list\n",
+    "    indented code\n",
+    "Trailing spaces  \nbreak lines.\n",
+    "It's \"quoted\" -- and dashed...\n",
+    "See [[main.py]].\n",
+    "=== A section ===\n",
+    "&amp; or &#38;\n",
+    "<b>html</b>\n",
+])
+def test_plain_text_html_rejects_markdown(text):
+    assert p.plain_text_html(text) is None
+
+
+@given(text(alphabet=u"aZé1 ,.;:?!()/&\n\t_-*#=[]`'\"<>"))
+def test_plain_text_html_equivalence(text):
+    html = p.plain_text_html(text)
+    if html is not None:
+        assert html == render_docs_slowly(text)
+
+
+@given(lists(text(), max_size=5), text())
+def test_template_matches_pystache(fragments, title):
+    import pystache
+    from pycco_resources import html, pycco_template
+    context = {
+        "title": title,
+        "stylesheet": "pycco.css",
+        "sections": [{"num": i, "docs_html": fragment, "code_html": fragment}
+                     for i, fragment in enumerate(fragments)],
+        "source": "",
+    }
+    # Pystache renders tags found in values, which the template has no
+    # need to do, so leave those out of the comparison.
+    assume(not any("{{" in fragment or "}}" in fragment for fragment in fragments))
+    assert pycco_template(context) == pystache.render(html, context)
+
+
+def test_generate_html_keeps_mustache_in_code():
+    code = "var a = '{{ b }}';\n// {{{ c }}}\nf({{}});\n"
+    js = supported_languages['.js']
+    sections = p.highlight(p.parse(code, js), js, outdir=tempfile.gettempdir())
+    html = p.generate_html("t.js", sections, outdir=tempfile.gettempdir())
+    assert b"{{ b }}" in html
+    assert b"{{{ c }}}" in html
+
+
+def test_streamed_page_matches_generate_html():
+    from pycco_resources import pycco_template
+    code = open(PYCCO_SOURCE).read()
+    sections = p.highlight(p.parse(code, PYTHON), PYTHON,
+                           outdir=tempfile.gettempdir())
+    context = p._page_context(PYCCO_SOURCE, sections, True,
+                              tempfile.gettempdir())
+    streamed = u"".join(pycco_template.render_iter(context))
+    assert streamed.encode("utf-8") == p.generate_html(
+        PYCCO_SOURCE, sections, outdir=tempfile.gettempdir())
+
+
+def test_iter_sources_order_and_filters(tmpdir):
+    for relpath in ["a.py", "b.py", "b/c.py", "b/d.js", "b-c/e.py",
+                    "node_modules/f.js", "build/g.py", "h/build/i.py"]:
+        tmpdir.join(relpath).ensure()
+    root = str(tmpdir)
+
+    walked = [os.path.join(dirpath, f)
+              for dirpath, _, filenames in os.walk(root)
+              for f in filenames if "node_modules" not in dirpath]
+    assert list(p._iter_sources([root])) == sorted(walked)
+
+    listed = []
+    scandir = p.pycco_scandir
+
+    def recording_scandir(directory):
+        listed.append(os.path.relpath(directory, root))
+        return scandir(directory)
+
+    with patch.object(p, 'pycco_scandir', recording_scandir):
+        found = list(p._iter_sources([root], include=["*.py"],
+                                     exclude=["build", "b/c.py"]))
+    assert [os.path.relpath(f, root) for f in found] == [
+        "a.py", os.path.join("b-c", "e.py"), "b.py"]
+    assert "build" not in listed
+    assert "node_modules" not in listed
+
+    explicit = str(tmpdir.join("b", "d.js"))
+    assert list(p._iter_sources([explicit], include=["*.py"])) == [explicit]
+
+
+def test_import_is_fast_and_light():
+    import subprocess
+    import sys
+    script = (
+        "import sys, time\n"
+        "start = time.time()\n"
+        "import pycco.main\n"
+        "print(time.time() - start)\n"
+        "print(' '.join(m for m in ('pygments', 'markdown') if m in sys.modules))\n"
+    )
+    output = subprocess.check_output([sys.executable, "-c", script],
+                                     cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    elapsed, heavy_modules = output.decode("utf-8").split("\n")[:2]
+    assert heavy_modules == ""
+    # A generous budget, still well below the cost of loading every lexer.
+    assert float(elapsed) < 0.5
+
+
+@pytest.mark.parametrize("source,code,name", [
+    ("Makefile", "all:\n\techo hi\n", "make"),
+    ("bin/tool", "#!/usr/bin/env python3.8\nprint(1)\n", "python"),
+    ("bin/tool", "#!/usr/bin/env -S node --harmony\n", "javascript"),
+    ("bin/tool", "#!/bin/sh\necho hi\n", "bash"),
+    ("script", "# -*- mode: ruby -*-\nputs 1\n", "ruby"),
+    ("script", "# -*- lua -*-\n", "lua"),
+    ("script", "x = 1\n# vim: set ft=python:\n", "python"),
+    ("script.in", "-- vi: filetype=sql\n", "sql"),
+])
+def test_get_language_without_extension(source, code, name):
+    with patch('pygments.lexers.guess_lexer') as guess_lexer:
+        assert p.get_language(source, code)["name"] == name
+        assert not guess_lexer.called
+
+
+def test_get_language_guesses_once_per_extension():
+    class Lexer:
+        name = 'Python'
+    p._guessed_languages.clear()
+    with patch('pygments.lexers.guess_lexer', return_value=Lexer()) as guess_lexer:
+        assert p.get_language("a.unknown", "x" * 100000) == PYTHON
+        assert p.get_language("b.unknown", "y") == PYTHON
+        assert guess_lexer.call_count == 1
+        assert len(guess_lexer.call_args[0][0]) == p.guess_sample_size
+    p._guessed_languages.clear()
+
+
+def test_parse_scales_linearly():
+    # An indented decorator keeps every following function in one section,
+    # which used to make each `def` line rescan all the code before it. Long
+    # lines make any such rescan dominate the time taken, and CPU time is
+    # measured, so that other processes on the machine don't count.
+    def best_time(n):
+        code = "    @decorated\n" + ("def f():\n    x = '" + "a" * 1000 + "'\n") * n
+        timings = []
+        for _ in range(5):
+            start = process_time()
+            p.parse(code, PYTHON)
+            timings.append(process_time() - start)
+        return min(timings)
+
+    small, large = best_time(500), best_time(8000)
+    # Sixteen times the input takes about 20 times as long in linear time,
+    # and over 250 times as long in quadratic time.
+    assert large < small * 80
+
+
+def code_html_text(code_html):
+    try:
+        from html import unescape as html_unescape
+    except ImportError:
+        from HTMLParser import HTMLParser
+        html_unescape = HTMLParser().unescape
+    assert code_html.startswith(p.highlight_start)
+    assert code_html.endswith(p.highlight_end)
+    inner = code_html[len(p.highlight_start):-len(p.highlight_end)]
+    return html_unescape(re.sub(r"<[^>]*>", "", inner))
+
+
+@given(data(), text(alphabet=u"ab #/*\"'\n\t{}-=@;%|<&\ufeff"))
+def test_highlight_keeps_code_in_its_section(data, code):
+    lang = get_language(data)
+    # Pygments drops a byte order mark at the start of its input.
+    for code in (code, u"\ufeff" + code):
+        sections = p.highlight(p.parse(code, lang), lang,
+                               outdir=tempfile.gettempdir())
+        for i, section in enumerate(sections):
+            text = section["code_text"].rstrip()
+            if i == 0 and text.startswith(u"\ufeff"):
+                text = text[1:]
+            assert code_html_text(section["code_html"]) == text.strip("\n")
+
+
+def test_highlight_section_boundary_inside_string():
+    code = "x = '''\n# Not really a comment.\n'''\ny = 1\n"
+    sections = p.highlight(p.parse(code, PYTHON), PYTHON,
+                           outdir=tempfile.gettempdir())
+    assert [code_html_text(s["code_html"]) for s in sections] == [
+        "x = '''", "'''\ny = 1"]